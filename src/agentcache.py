@@ -0,0 +1,71 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class AgentStatsCache(object):
+    # When the statistics of every Mesos Agent were last fetched, the
+    # samples taken from them live in the SampleStore. Agents running
+    # tasks of Apps close to a scaling threshold are refreshed every cycle,
+    # the refresh interval of the others doubles each time they are found
+    # still cold, up to max_interval. Agents that left the cluster are
+    # evicted least recently used first
+
+    def select(self, hosts, hot_hosts, now=None):
+        # Return the hosts that need to be fetched this cycle
+        now = now or time.time()
+        selected = []
+        with self.lock:
+            for host in hosts:
+                entry = self.entries.get(host)
+                if host in hot_hosts:
+                    if entry:
+                        entry['interval'] = self.min_interval
+                    selected.append(host)
+                elif not entry or now - entry['fetched'] >= entry['interval']:
+                    selected.append(host)
+        return selected
+
+    def update(self, host, hot, now=None):
+        now = now or time.time()
+        with self.lock:
+            entry = self.entries.pop(host, None)
+            interval = self.min_interval
+            if entry and not hot:
+                interval = min(entry['interval'] * 2, self.max_interval)
+            self.entries[host] = {'fetched': now, 'interval': interval,
+                                  'seen': now}
+            while len(self.entries) > self.max_agents:
+                self.entries.popitem(last=False)
+
+    def get(self, host, now=None):
+        # Return the age in seconds of the last fetch of an agent and mark it
+        # as recently used, or None
+        now = now or time.time()
+        with self.lock:
+            entry = self.entries.pop(host, None)
+            if not entry:
+                return None
+            self.entries[host] = entry
+            return now - entry['fetched']
+
+    def evict(self, hosts, now=None):
+        # Drop agents that are no longer running any task and have not been
+        # seen for max_idle seconds
+        now = now or time.time()
+        with self.lock:
+            for host in self.entries.keys():
+                if host in hosts:
+                    self.entries[host]['seen'] = now
+                elif now - self.entries[host].get('seen', now) >= \
+                        self.max_idle:
+                    del self.entries[host]
+
+    def __init__(self, min_interval=5, max_interval=60, max_agents=1024,
+                 max_idle=300):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_agents = max_agents
+        self.max_idle = max_idle
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
@@ -2,17 +2,37 @@
 
 import os
 import sys
+import math
 import time
 import signal
-import requests
 import threading
 import traceback
 from multiprocessing import Process
 
 from config import Config
 from mesos import Mesos
+from transport import Transport
 from marathon import Marathon
-from httpserver import HttpServer
+from fanout import FanOut
+from deployments import DeploymentTracker
+from samples import SampleStore
+from metrics import Metrics
+from profiling import Profiler
+from telemetry import TelemetryWriter
+from checkpoint import Checkpoint
+from events import MarathonEventStream
+from agentcache import AgentStatsCache
+from collector import ShardedCollector
+from coordination import Coordinator, new_membership, instance_id
+from forecast import FORECASTERS, UtilizationHistory
+from planner import ScalingPlan
+from scheduler import PollScheduler
+from capacity import CapacityPlanner
+from statsource import STATISTICS_SOURCES, AgentDirectory, agent_auth
+from policy import Policy, PolicyIndex
+import utilization
+import jsonstream
+from healthserver import HealthServer
 
 MARATHON_POLL_INTERVAL = 5
 MARATHON_SAMPLE_SIZE = 4
@@ -27,21 +47,101 @@ MARATHON_APP_MEM_SCALE = 0.5        # scale app memory by this amount
 MAX_CPUS_ALLOC = 0.5  # Max percentage of free CPU to give out to a single task
 MAX_MEM_ALLOC = 0.5  # Max percentage of free Mem to give out to a single task
 
+AGENT_POOLS = 128  # Number of Mesos Agents to keep connections open to
+AGENT_HOT_MARGIN = 0.15  # Utilization margin to a threshold to refresh often
 
-def get_task_statistics(task_id, host):
-    # Get the performance Metrics for all the tasks for the Marathon App
-    # specified by connecting to the Mesos Agent and then making a REST call
-    # against Mesos statistics
-    # Return to Statistics for the specific task for the marathon_app
+FORECAST_MIN_SAMPLES = 4  # App samples needed before trusting a forecast
 
-    response = requests.get('http://' + host + ':5051/monitor/statistics.json')\
-                     .json()
 
-    for task in response:
-        executor_id = task['executor_id']
-        if (executor_id == task_id):
-            task_stats = task['statistics']
-            return task_stats
+def get_agent_statistics(target):
+    # Get the performance Metrics for every executor running on the Mesos
+    # Agent by making a single REST call against the statistics source
+    # target is the (host, base URL) of the agent
+    # Return a dict of executor_id to statistics for that agent, or None when
+    # the agent could not be reached
+
+    stream = config.stream_parsing and jsonstream.available()
+    try:
+        return stats_source.fetch(agent_transport, target[1], stream)
+    except Exception:
+        traceback.print_exc()
+        return None
+
+
+def collect_task_statistics(apps_details):
+    # Group the tasks of all Marathon Apps by the host they run on so every
+    # Mesos Agent is queried only once per poll cycle. With the agent cache
+    # on, agents only running tasks of Apps far from any threshold are
+    # refreshed less often
+    # Return an index of executor_id to statistics across the refreshed
+    # agents and a dict of the other agents to the age of their statistics
+
+    hosts = set()
+    hot_hosts = set()
+    for app, app_details in apps_details.items():
+        if not app_details:
+            continue
+        hot = app_heat.get(app, True)
+        for task_id, task_details in app_details['tasks'].items():
+            hosts.add(task_details['host'])
+            if hot:
+                hot_hosts.add(task_details['host'])
+
+    selected = list(hosts)
+    if agent_cache:
+        agent_cache.evict(hosts)
+        selected = agent_cache.select(hosts, hot_hosts)
+
+    targets = [(host, agent_directory.url(host)) for host in selected]
+    if collector:
+        # fetched and parsed by the worker processes
+        fetched = []
+        for host, agent_stats, status, elapsed in collector.collect(targets):
+            observe_agent_request(host, status, elapsed)
+            fetched.append(agent_stats)
+    else:
+        fetched = fanout.map(get_agent_statistics, targets,
+                             host=lambda target: target[0])
+
+    task_stats_index = {}
+    stale_hosts = {}
+    for host, agent_stats in zip(selected, fetched):
+        if agent_stats is None:
+            if agent_cache:
+                stale_hosts[host] = None
+            continue
+        task_stats_index.update(agent_stats)
+        if agent_cache:
+            agent_cache.update(host, host in hot_hosts)
+
+    if agent_cache:
+        for host in hosts.difference(selected):
+            stale_hosts[host] = None
+        for host in stale_hosts:
+            stale_hosts[host] = agent_cache.get(host)
+    return task_stats_index, stale_hosts
+
+
+def get_marathon_apps_details():
+    # Get the details of every Marathon App, either from the event stream
+    # index, with a single bulk query or with one query per App fanned out
+    # over the pool
+
+    if event_stream:
+        return event_stream.get_apps_details()
+
+    if config.marathon_bulk:
+        return marathon.get_all_app_details()
+
+    marathon_apps = marathon.get_all_apps()
+    if not marathon_apps:
+        return None
+
+    # print "Currently deployed apps: " + str(marathon_apps)
+
+    return dict(zip(marathon_apps, fanout.map(
+        marathon.get_app_details, marathon_apps,
+        host=lambda app: marathon.marathon_host)))
 
 
 def get_timestamp(task_stats):
@@ -54,62 +154,47 @@ def get_timestamp(task_stats):
     return timestamp
 
 
-def task_in_prior_sample(samples, app, task_id, trailing_sample_index):
-    if samples[trailing_sample_index] and \
-       app in samples[trailing_sample_index] and \
-       task_id in samples[trailing_sample_index][app]['tasks'] and \
-       samples[trailing_sample_index][app]['tasks'][task_id]:
-
-        return True
-
-    else:
-        return False
-
-
-def get_cpu_util(samples, app, task_id, trailing_sample_index, cpus_time,
-                 timestamp):
+def get_cpu_util(samples, task_id, cpus_time, timestamp):
     cpu_util = 0
 
-    # Make sure have a sample of app and task data and
+    # Make sure have a sample of task data and
     # then calculate CPU utilization as follows:
     # (prior cpus_time - current cpus_time) / (elapased time)
-    if task_in_prior_sample(samples, app, task_id, trailing_sample_index):
-        cpu_util = (cpus_time - samples[trailing_sample_index][app]['tasks']
-                    [task_id]['cpus_time']) / (timestamp -
-                                               samples[trailing_sample_index]
-                                               [app]['tasks'][task_id]
-                                               ['timestamp'])
+    slot = samples.prior(task_id)
+    if slot is not None:
+        elapsed = timestamp - samples.last(slot, 'timestamp')
+        if elapsed > 0:
+            cpu_util = (cpus_time - samples.last(slot, 'cpus_time')) / elapsed
     return cpu_util
 
 
 """
 Returns number of samples collected for a task. Max number of samples collected
-is MARATHON_SAMPLE_SIZE
+is the sample size of the App's policy, MARATHON_SAMPLE_SIZE by default
 """
 
 
-def get_sample_count(samples, app, task_id, trailing_sample_index):
+def get_sample_count(samples, task_id, sample_size=None):
     sample_count = 0
 
-    if task_in_prior_sample(samples, app, task_id, trailing_sample_index) and \
-       'sample_count' in samples[trailing_sample_index][app]['tasks'][task_id]:
-        sample_count = min(samples[trailing_sample_index][app]['tasks'][task_id]
-                           ['sample_count'], MARATHON_SAMPLE_SIZE)
+    slot = samples.prior(task_id)
+    if slot is not None:
+        sample_count = min(samples.last(slot, 'sample_count'),
+                           sample_size or MARATHON_SAMPLE_SIZE)
 
     return sample_count
 
 
-def get_avg_resource_util(samples, app, task_id, trailing_sample_index,
-                          resource_util, resource_name):
+def get_avg_resource_util(samples, task_id, resource_util, resource_name,
+                          sample_size=None):
     avg_resource_util = resource_util
     prior_avg_resource_util = 0.0
     sample_count = 1
-    if task_in_prior_sample(samples, app, task_id, trailing_sample_index) and \
-       resource_name in samples[trailing_sample_index][app]['tasks'][task_id]:
-        sample_count = float(get_sample_count(samples, app, task_id,
-                                              trailing_sample_index) + 1)
-        prior_avg_resource_util = \
-            samples[trailing_sample_index][app]['tasks'][task_id][resource_name]
+    slot = samples.prior(task_id)
+    if slot is not None:
+        sample_count = float(get_sample_count(samples, task_id,
+                                              sample_size) + 1)
+        prior_avg_resource_util = samples.last(slot, resource_name)
 
         avg_resource_util = ((1/sample_count) * resource_util) +\
             (((sample_count - 1)/sample_count) * prior_avg_resource_util)
@@ -117,40 +202,100 @@ def get_avg_resource_util(samples, app, task_id, trailing_sample_index,
     return avg_resource_util
 
 
-def app_reached_min_mem_threshold(app_avg_mem_util):
-    if app_avg_mem_util <= MARATHON_MIN_MEM_THRESHOLD:
+def app_reached_min_mem_threshold(app_avg_mem_util, policy):
+    if app_avg_mem_util <= policy.min_mem_threshold:
         return True
     else:
         return False
 
 
-def app_reached_min_cpu_threshold(app_avg_cpu_util):
+def app_reached_min_cpu_threshold(app_avg_cpu_util, policy):
     # If task CPU utilization is within +20% of MARATHON_MAX_CPU_THRESHOLD
     # then scale the task. e.g. 90%-110%, 190%-210%, 290%-310%, etc.
-    if app_avg_cpu_util <= MARATHON_MIN_CPU_THRESHOLD:
+    if app_avg_cpu_util <= policy.min_cpu_threshold:
         return True
     else:
         return False
 
 
-def app_reached_max_mem_threshold(app_avg_mem_util):
-    if app_avg_mem_util >= MARATHON_MAX_MEM_THRESHOLD:
+def app_reached_max_mem_threshold(app_avg_mem_util, policy):
+    if app_avg_mem_util >= policy.max_mem_threshold:
         return True
     else:
         return False
 
 
-def app_reached_max_cpu_threshold(app_avg_cpu_util):
+def app_reached_max_cpu_threshold(app_avg_cpu_util, policy):
     # If task CPU utilization is within +20% of MARATHON_MAX_CPU_THRESHOLD
     # then scale the task. e.g. 90%-110%, 190%-210%, 290%-310%, etc.
     if app_avg_cpu_util > 0.5 and (
-       app_avg_cpu_util % 1.0 >= MARATHON_MAX_CPU_THRESHOLD or
-       app_avg_cpu_util % 1.0 <= 1 - MARATHON_MAX_CPU_THRESHOLD):
+       app_avg_cpu_util % 1.0 >= policy.max_cpu_threshold or
+       app_avg_cpu_util % 1.0 <= 1 - policy.max_cpu_threshold):
         return True
     else:
         return False
 
 
+def forecast_reaches(app_details, name):
+    # Whether the utilization of an App is rising and forecast to cross the
+    # next threshold above it by the time a deployment submitted now would
+    # finish. CPU thresholds repeat every whole CPU, the band check of the
+    # current average would miss a steep rise that overshoots the band
+    forecast = app_details.get('forecast_' + name)
+    if forecast is None or forecast <= app_details[name]:
+        return False
+    policy = app_details['policy']
+    if name == 'cpu_util':
+        return forecast >= math.floor(app_details[name]) + \
+            policy.max_cpu_threshold
+    return forecast >= policy.max_mem_threshold
+
+
+def default_policy():
+    # The policy of Apps no section or label applies to, from the module
+    # settings so they can still be overridden as a whole
+    return Policy(min_instances=MARATHON_MIN_TASK_COUNT, max_instances=0,
+                  min_cpu_threshold=MARATHON_MIN_CPU_THRESHOLD,
+                  max_cpu_threshold=MARATHON_MAX_CPU_THRESHOLD,
+                  min_mem_threshold=MARATHON_MIN_MEM_THRESHOLD,
+                  max_mem_threshold=MARATHON_MAX_MEM_THRESHOLD,
+                  mem_scale=MARATHON_APP_MEM_SCALE,
+                  sample_size=MARATHON_SAMPLE_SIZE)
+
+
+def assign_policies(apps_details):
+    # Look up the policy of every App, only Apps that are new or whose
+    # labels changed have theirs derived again
+    policies.prune(apps_details)
+    for app, app_details in apps_details.items():
+        if not app_details:
+            continue
+        policy = policies.lookup(app, app_details.get('labels'))
+        app_details['policy'] = policy
+        app_details['sample_size'] = policy.sample_size
+
+
+def forecast_apps(apps_details, timestamp):
+    # Add the latest utilization of every App to its history and forecast it
+    # one deployment ahead
+    history.prune(apps_details)
+    horizon = config.forecast_horizon or \
+        deployments.expected_duration(MARATHON_POLL_INTERVAL * 12)
+    for app, app_details in apps_details.items():
+        # the first sample of a task has no CPU utilization yet
+        if not app_details or app_details['max_samples_in_app'] < 2:
+            continue
+        history.record(app, timestamp, app_details['cpu_util'],
+                       app_details['mem_util'])
+        times, cpu_utils, mem_utils = history.series(app)
+        if len(times) < FORECAST_MIN_SAMPLES:
+            continue
+        app_details['forecast_cpu_util'] = \
+            forecaster.forecast(times, cpu_utils, horizon)
+        app_details['forecast_mem_util'] = \
+            forecaster.forecast(times, mem_utils, horizon)
+
+
 def allocate_app_mem(app_details):
     if float(app_details['mem'] * len(app_details['tasks'])) /\
             mesos.get_mem_free() < MAX_MEM_ALLOC:
@@ -166,39 +311,196 @@ def mesos_cpus_available(app_details):
         return False
 
 
+def capacity_available(app, action, cpus, mem):
+    # Whether a task of cpus and mem can be placed on a single agent. The
+    # task is taken off that agent's free resources straight away
+    if not capacity or capacity.place(cpus, mem):
+        return True
+    metrics.inc('autoscaler_scaling_unplaceable_total',
+                labels={'app': app, 'action': action})
+    return False
+
+
 def reset_sample_count(app_details):
     for task_id, task_details in app_details['tasks'].items():
-        task_details['sample_count'] = 0
+        if task_details:
+            task_details['sample_count'] = 0
+        samples.reset_sample_count(task_id)
+
+
+def scaling_submitted(app, app_details, action, deployment_id):
+    deployments.track(app, deployment_id)
+    metrics.inc('autoscaler_scaling_actions_total',
+                labels={'app': app, 'action': action})
+    reset_sample_count(app_details)
+    # the history before the change doesn't predict what comes after it
+    if forecaster:
+        history.reset(app)
+
+
+def scaleup_marathon_app(app, app_details, plan):
+    # Resources are reserved as soon as a scale up is planned so the Apps
+    # planned after it in the same cycle only get what is left
+    policy = app_details['policy']
+
+    if app_reached_max_mem_threshold(app_details['app_avg_mem_util'],
+                                     policy) or \
+            forecast_reaches(app_details, 'mem_util'):
+        # tasks are restarted with the new memory one at a time, which
+        # needs room for one of them next to the others
+        offered_mem = allocate_app_mem(app_details)
+        if offered_mem > app_details['mem'] and \
+                capacity_available(app, 'mem_up', app_details['cpus'],
+                                   offered_mem):
+            mesos.reserve(mem=(offered_mem - app_details['mem']) *
+                          app_details['task_count'])
+            plan.add(app, app_details, 'mem_up', {'mem': offered_mem})
+        return
 
+    if app_reached_max_cpu_threshold(app_details['app_avg_cpu_util'],
+                                     policy) or \
+            forecast_reaches(app_details, 'cpu_util'):
+        if policy.max_instances and \
+                app_details['task_count'] >= policy.max_instances:
+            return
+        if mesos_cpus_available(app_details) and \
+                capacity_available(app, 'instances_up', app_details['cpus'],
+                                   app_details['mem']):
+            mesos.reserve(cpus=app_details['cpus'], mem=app_details['mem'])
+            plan.add(app, app_details, 'instances_up',
+                     {'instances': app_details['task_count'] + 1})
+
+
+def scaledown_marathon_app(app, app_details, plan):
+    policy = app_details['policy']
+
+    if app_reached_min_mem_threshold(app_details['app_avg_mem_util'],
+                                     policy) and\
+            app_details['task_count'] > policy.min_instances:
+        plan.add(app, app_details, 'mem_down',
+                 {'mem': int(app_details['mem'] * policy.mem_scale)})
+        return
 
-def scaleup_marathon_app(app, app_details):
+    if app_reached_min_cpu_threshold(app_details['app_avg_cpu_util'],
+                                     policy) and\
+            app_details['task_count'] > policy.min_instances:
+        plan.add(app, app_details, 'instances_down',
+                 {'instances': app_details['task_count'] - 1})
 
-    if app_reached_max_mem_threshold(app_details['app_avg_mem_util']):
-        offered_mem = allocate_app_mem(app_details)
-        if offered_mem > app_details['mem']:
-            if marathon.scale_app_mem(app, offered_mem):
-                reset_sample_count(app_details)
-        return
 
-    if app_reached_max_cpu_threshold(app_details['app_avg_cpu_util']):
-        if mesos_cpus_available(app_details):
-            if marathon.scale_app_instances(app, app_details['task_count'] + 1):
-                reset_sample_count(app_details)
+def scaling_urgency(app_details):
+    # How far past its limits an App is, the most saturated Apps are planned
+    # first so they get the free resources
+    return max(app_details['app_avg_cpu_util'] / (app_details['cpus'] or 1),
+               app_details['app_avg_mem_util'] /
+               app_details['policy'].max_mem_threshold)
 
 
-def scaledown_marathon_app(app, app_details):
+def sample_app_tasks(apps_details, task_stats_index):
+    # Work out the utilization of every task from its statistics and the
+    # prior sample, then roll it up into the App
 
-    if app_reached_min_mem_threshold(app_details['app_avg_mem_util']) and\
-            app_details['task_count'] > MARATHON_MIN_TASK_COUNT:
-        if marathon.scale_app_mem(app, int(app_details['mem'] *
-                                           MARATHON_APP_MEM_SCALE)):
-            reset_sample_count(app_details)
-        return
+    for app, app_details in apps_details.items():
+        if not app_details:
+            continue
+        apps_details[app]['cpu_util'] = 0.0
+        apps_details[app]['mem_util'] = 0.0
+        apps_details[app]['max_samples_in_app'] = 0
+        sample_size = app_details.get('sample_size', MARATHON_SAMPLE_SIZE)
+        for task_id, task_details in app_details['tasks'].items():
+            task_stats = task_stats_index.get(task_id)
+            if not task_stats:
+                apps_details[app]['tasks'][task_id] = None
+                continue
 
-    if app_reached_min_cpu_threshold(app_details['app_avg_cpu_util']) and\
-            app_details['task_count'] > MARATHON_MIN_TASK_COUNT:
-        if marathon.scale_app_instances(app, app_details['task_count'] - 1):
-            reset_sample_count(app_details)
+            timestamp = get_timestamp(task_stats)
+
+            cpus_time = (task_stats['cpus_system_time_secs'] +
+                         task_stats['cpus_user_time_secs'])
+
+            cpu_util = get_cpu_util(samples, task_id, cpus_time, timestamp)
+
+            mem_rss_bytes = int(task_stats['mem_rss_bytes'])
+            mem_limit_bytes = int(task_stats['mem_limit_bytes'])
+            mem_util = (float(mem_rss_bytes) /
+                        float(mem_limit_bytes))
+
+            task_details['timestamp'] = timestamp
+            task_details['cpus_time'] = cpus_time
+            task_details['cpu_util'] = cpu_util
+            task_details['mem_rss_bytes'] = mem_rss_bytes
+            task_details['mem_limit_bytes'] = mem_limit_bytes
+            task_details['mem_util'] = mem_util
+            task_details['sample_count'] = \
+                get_sample_count(samples, task_id, sample_size) + 1
+            task_details['avg_cpu_util'] = \
+                get_avg_resource_util(samples, task_id, cpu_util,
+                                      'avg_cpu_util', sample_size)
+            task_details['avg_mem_util'] = \
+                get_avg_resource_util(samples, task_id, mem_util,
+                                      'avg_mem_util', sample_size)
+            apps_details[app]['cpu_util'] = \
+                apps_details[app]['cpu_util'] + cpu_util
+            apps_details[app]['mem_util'] = \
+                apps_details[app]['mem_util'] + mem_util
+            apps_details[app]['max_samples_in_app'] = \
+                max(task_details['sample_count'],
+                    apps_details[app]['max_samples_in_app'])
+
+        apps_details[app]['cpu_util'] = \
+            apps_details[app]['cpu_util'] / len(app_details['tasks'])
+        apps_details[app]['mem_util'] = \
+            apps_details[app]['mem_util'] / len(app_details['tasks'])
+        apps_details[app]['task_count'] = len(app_details['tasks'])
+
+
+def carry_stale_tasks(apps_details, stale_tasks, stale_hosts):
+    # Fill in the tasks on agents that were not refreshed this cycle from
+    # their last sample and record the age of the oldest statistics each App
+    # decision relies on. Tasks of agents that were never fetched stay out
+
+    carried = {}
+    for (app, task_id), host in stale_tasks.items():
+        app_details = apps_details[app]
+        age = stale_hosts[host]
+        task_details = samples.carry(task_id) if age is not None else None
+        if task_details is None:
+            app_details['stats_age'] = float('inf')
+            continue
+        task_details['host'] = host
+        app_details['tasks'][task_id] = task_details
+        app_details['stats_age'] = max(app_details.get('stats_age', 0), age)
+        app_details['cpu_util'] = app_details['cpu_util'] + \
+            task_details['cpu_util'] / app_details['task_count']
+        app_details['mem_util'] = app_details['mem_util'] + \
+            task_details['mem_util'] / app_details['task_count']
+        app_details['max_samples_in_app'] = max(
+            app_details['max_samples_in_app'], task_details['sample_count'])
+        carried[app] = app_details
+    compute_app_averages(carried)
+
+
+def app_near_threshold(app_details):
+    # Whether an App is within AGENT_HOT_MARGIN of a scaling threshold, or
+    # still collecting its first samples, so its agents are refreshed every
+    # cycle
+    policy = app_details['policy']
+    if app_details['max_samples_in_app'] < policy.sample_size:
+        return True
+    cpu_util = app_details['app_avg_cpu_util']
+    mem_util = app_details['app_avg_mem_util']
+    if mem_util >= policy.max_mem_threshold - AGENT_HOT_MARGIN:
+        return True
+    if cpu_util > 0.5 - AGENT_HOT_MARGIN and (
+            cpu_util % 1.0 >= policy.max_cpu_threshold - AGENT_HOT_MARGIN or
+            cpu_util % 1.0 <= 1 - policy.max_cpu_threshold +
+            AGENT_HOT_MARGIN):
+        return True
+    if app_details['task_count'] > policy.min_instances and (
+            cpu_util <= policy.min_cpu_threshold + AGENT_HOT_MARGIN or
+            mem_util <= policy.min_mem_threshold + AGENT_HOT_MARGIN):
+        return True
+    return False
 
 
 def compute_app_averages(marathon_apps):
@@ -229,20 +531,45 @@ def compute_app_averages(marathon_apps):
 
 def scale_marathon_apps(marathon_apps):
 
-    for app, app_details in marathon_apps.items():
-        if not app_details or\
-                app_details['max_samples_in_app'] < MARATHON_SAMPLE_SIZE:
+    plan = ScalingPlan(config.scaling_batch_size)
+    candidates = [(app, app_details)
+                  for app, app_details in marathon_apps.items()
+                  if app_details and app_details['policy'].enabled and
+                  app_details['max_samples_in_app'] >=
+                  app_details['policy'].sample_size]
+    candidates.sort(key=lambda candidate: scaling_urgency(candidate[1]),
+                    reverse=True)
+
+    for app, app_details in candidates:
+        # leave apps alone until their last deployment has rolled out and
+        # for the cooldown of their policy after that
+        if deployments.is_deploying(app) or \
+                deployments.since_scaled(app) < \
+                app_details['policy'].cooldown:
+            continue
+        # don't act on statistics older than the staleness budget
+        if app_details.get('stats_age', 0) > config.agent_staleness_budget:
+            continue
+        # leave the app to the leader or to the instance that owns it
+        if coordinator and not coordinator.may_scale(app):
             continue
         # scale up cpu or mem resources if the app is hitting allocation limit
-        scaleup_marathon_app(app, app_details)
-        # scale down cpu or mem resources if they are underutilized
-        scaledown_marathon_app(app, app_details)
+        scaleup_marathon_app(app, app_details, plan)
+        # scale down cpu or mem resources if they are underutilized, unless a
+        # scale up was just planned for the app
+        if app not in plan:
+            scaledown_marathon_app(app, app_details, plan)
+
+    for app, app_details, action, deployment_id in plan.submit(marathon):
+        scaling_submitted(app, app_details, action, deployment_id)
 
 
 def print_stats(apps_details):
 
     print "\nApp count: {0}".format(len(apps_details))
     for app, app_details in apps_details.items():
+        if not app_details:
+            continue
         print "Name: {0:<24.24} Instances: {1:<5} CPU: {2:<10.2%}\
 Avg CPU: {3:<10.2%} Mem: {4:<10.2%} Avg Mem: {5:<10.2%}"\
             .format(app, app_details['task_count'],
@@ -252,110 +579,237 @@ Avg CPU: {3:<10.2%} Mem: {4:<10.2%} Avg Mem: {5:<10.2%}"\
                     app_details['app_avg_mem_util'])
 
 
+def describe_metrics():
+    metrics.describe('autoscaler_app_cpu_util', 'gauge',
+                     'CPU utilization of the app in the last sample')
+    metrics.describe('autoscaler_app_mem_util', 'gauge',
+                     'Memory utilization of the app in the last sample')
+    metrics.describe('autoscaler_app_avg_cpu_util', 'gauge',
+                     'CPU utilization of the app averaged over the window')
+    metrics.describe('autoscaler_app_avg_mem_util', 'gauge',
+                     'Memory utilization of the app averaged over the window')
+    metrics.describe('autoscaler_app_tasks', 'gauge',
+                     'Number of tasks of the app')
+    metrics.describe('autoscaler_scaling_actions_total', 'counter',
+                     'Scaling actions submitted to Marathon')
+    metrics.describe('autoscaler_scaling_unplaceable_total', 'counter',
+                     'Scale ups held back because no agent has room for them')
+    metrics.describe('autoscaler_http_request_seconds', 'histogram',
+                     'Latency of requests to Marathon, Mesos and the agents')
+    metrics.describe('autoscaler_poll_cycle_seconds', 'histogram',
+                     'Duration of a poll cycle')
+    metrics.describe('autoscaler_poll_backlog_seconds', 'gauge',
+                     'How far the last poll cycle overran the poll interval')
+    metrics.describe('autoscaler_poll_errors_total', 'counter',
+                     'Poll cycles that failed with an error')
+    metrics.describe('autoscaler_poll_interval_seconds', 'gauge',
+                     'Current period of the poll scheduler')
+    metrics.describe('autoscaler_poll_skipped_ticks', 'gauge',
+                     'Poll ticks skipped because a cycle overran them')
+    metrics.describe('autoscaler_deployments_in_flight', 'gauge',
+                     'Deployments submitted and not yet finished')
+    metrics.describe('autoscaler_span_seconds', 'gauge',
+                     'Rolling quantiles of poll cycle phases and requests')
+    metrics.describe('autoscaler_coordination_members', 'gauge',
+                     'Live autoscaler instances seen by this one')
+    metrics.describe('autoscaler_coordination_leader', 'gauge',
+                     'Whether this instance holds the leader lease')
+
+
+def observe_request(name, method, url, response, elapsed):
+    code = 'error'
+    if response is not None:
+        code = response.status_code
+    metrics.observe('autoscaler_http_request_seconds', elapsed,
+                    labels={'client': name, 'method': method, 'code': code})
+    if scheduler:
+        scheduler.observe(name, method, url, response.status_code
+                          if response is not None else None, elapsed)
+
+
+def observe_agent_request(host, status, elapsed):
+    # Account for a request made by a collector worker process the same way
+    # the transport listeners do in this one
+    metrics.observe('autoscaler_http_request_seconds', elapsed,
+                    labels={'client': 'agent', 'method': stats_source.METHOD,
+                            'code': status})
+    profiler.record('request.agent', elapsed, type='request', client='agent',
+                    method=stats_source.METHOD,
+                    host=agent_directory.lookup(host)[1],
+                    endpoint=stats_source.PATH, status=status)
+
+
+def publish_metrics(apps_details, cycle_time):
+    for name in ('autoscaler_app_cpu_util', 'autoscaler_app_mem_util',
+                 'autoscaler_app_avg_cpu_util', 'autoscaler_app_avg_mem_util',
+                 'autoscaler_app_tasks'):
+        metrics.clear(name)
+
+    for app, app_details in apps_details.items():
+        if not app_details:
+            continue
+        labels = {'app': app}
+        metrics.set('autoscaler_app_cpu_util', app_details['cpu_util'], labels)
+        metrics.set('autoscaler_app_mem_util', app_details['mem_util'], labels)
+        metrics.set('autoscaler_app_avg_cpu_util',
+                    app_details['app_avg_cpu_util'], labels)
+        metrics.set('autoscaler_app_avg_mem_util',
+                    app_details['app_avg_mem_util'], labels)
+        metrics.set('autoscaler_app_tasks', app_details['task_count'], labels)
+
+    metrics.observe('autoscaler_poll_cycle_seconds', cycle_time)
+    period = scheduler.period if scheduler else MARATHON_POLL_INTERVAL
+    metrics.set('autoscaler_poll_backlog_seconds',
+                max(0.0, cycle_time - period))
+    if scheduler:
+        metrics.set('autoscaler_poll_interval_seconds', period)
+        metrics.set('autoscaler_poll_skipped_ticks', scheduler.skipped)
+    metrics.set('autoscaler_deployments_in_flight',
+                deployments.get_deploying_count())
+    if coordinator:
+        metrics.set('autoscaler_coordination_members',
+                    len(coordinator.members))
+        metrics.set('autoscaler_coordination_leader',
+                    1 if coordinator.leader else 0)
+    for span, summary in profiler.summary().items():
+        for quantile in Profiler.QUANTILES:
+            metrics.set('autoscaler_span_seconds',
+                        summary['p%d' % (quantile * 100)],
+                        {'span': span, 'quantile': quantile})
+    metrics.publish()
+
+
+def profile_signal_handler(signm, frame):
+    print "Got signal " + str(signm) + ", profiling next poll cycle"
+    profiler.request_profile()
+
+
 def signal_handler(signm, frame):
     print "Got signal " + str(signm) + ", exiting now"
-    httpserver_process.terminate()
+    # hand over leadership and apps without waiting for the lease to expire
+    if coordinator:
+        coordinator.close()
+    if httpserver_process:
+        httpserver_process.terminate()
     sys.exit(0)
 
 
-def marathon_poll():
-    samples = [None] * MARATHON_SAMPLE_SIZE
-    sample_index = 0
-    trailing_sample_index = 0
+def process_cycle(apps_details, task_stats_index, cycle_start,
+                  stale_hosts=None, timestamp=None):
+    # Update the samples from the collected statistics and make the scaling
+    # decisions for this cycle. stale_hosts maps agents that were not
+    # refreshed to the age of their statistics, timestamp is when the
+    # statistics were collected if not at cycle_start
 
-    while True:
-        try:
-            time.sleep(MARATHON_POLL_INTERVAL)
-            marathon_apps = marathon.get_all_apps()
-            if not marathon_apps:
+    assign_policies(apps_details)
+
+    stale_tasks = {}
+    if stale_hosts:
+        for app, app_details in apps_details.items():
+            if not app_details:
                 continue
+            for task_id, task_details in app_details['tasks'].items():
+                if task_details['host'] in stale_hosts:
+                    stale_tasks[(app, task_id)] = task_details['host']
+
+    with profiler.span('averaging', tasks=len(task_stats_index)):
+        if config.vectorized and utilization.available():
+            utilization.compute_utilization(apps_details, task_stats_index,
+                                            samples, MARATHON_SAMPLE_SIZE)
+        else:
+            sample_app_tasks(apps_details, task_stats_index)
+            compute_app_averages(apps_details)
+        if stale_tasks:
+            carry_stale_tasks(apps_details, stale_tasks, stale_hosts)
+    # only the Apps of this cycle, Apps that are gone or no longer collected
+    # by this instance must not keep the poll period short
+    for app in set(app_heat).difference(
+            app for app, app_details in apps_details.items() if app_details):
+        del app_heat[app]
+    for app, app_details in apps_details.items():
+        if app_details:
+            app_heat[app] = app_near_threshold(app_details)
+    if forecaster:
+        with profiler.span('forecast'):
+            forecast_apps(apps_details, timestamp or cycle_start)
+    print_stats(apps_details)
+
+    # store collected sample
+    samples.commit(apps_details)
+
+    with profiler.span('deployments'):
+        # the samples taken while a deployment rolled out don't reflect the
+        # capacity it left the App with, start over once it is done
+        for app in deployments.refresh():
+            if apps_details.get(app):
+                reset_sample_count(apps_details[app])
+                apps_details[app]['max_samples_in_app'] = 0
+    with profiler.span('scaling'):
+        scale_marathon_apps(apps_details)
 
-            # print "Currently deployed apps: " + str(marathon_apps)
+    if checkpoint:
+        with profiler.span('checkpoint'):
+            checkpoint.save(samples)
 
-            apps_details = {}
-            for app in marathon_apps:
-                apps_details[app] = marathon.get_app_details(app)
+    cycle_time = time.time() - cycle_start
+    profiler.record('cycle', cycle_time)
+    publish_metrics(apps_details, cycle_time)
 
-            if not apps_details:
-                continue
 
-            for app, app_details in apps_details.items():
-                if not app_details:
-                    apps_details[app]['tasks'] = None
-                    continue
-                apps_details[app]['cpu_util'] = 0.0
-                apps_details[app]['mem_util'] = 0.0
-                apps_details[app]['max_samples_in_app'] = 0
-                for task_id, task_details in app_details['tasks'].items():
-                    task_stats = get_task_statistics(task_id,
-                                                     task_details['host'])
-                    if not task_stats:
-                        apps_details[app]['tasks'][task_id] = None
-                        continue
-
-                    timestamp = get_timestamp(task_stats)
-
-                    cpus_time = (task_stats['cpus_system_time_secs'] +
-                                 task_stats['cpus_user_time_secs'])
-
-                    cpu_util = get_cpu_util(samples, app, task_id,
-                                            trailing_sample_index, cpus_time,
-                                            timestamp)
-
-                    mem_rss_bytes = int(task_stats['mem_rss_bytes'])
-                    mem_limit_bytes = int(task_stats['mem_limit_bytes'])
-                    mem_util = (float(mem_rss_bytes) /
-                                float(mem_limit_bytes))
-
-                    apps_details[app]['tasks'][task_id]['timestamp'] = timestamp
-                    apps_details[app]['tasks'][task_id]['cpus_time'] = cpus_time
-                    apps_details[app]['tasks'][task_id]['cpu_util'] = cpu_util
-                    apps_details[app]['tasks'][task_id]['mem_rss_bytes'] = \
-                        mem_rss_bytes
-                    apps_details[app]['tasks'][task_id]['mem_limit_bytes'] = \
-                        mem_limit_bytes
-                    apps_details[app]['tasks'][task_id]['mem_util'] = mem_util
-                    apps_details[app]['tasks'][task_id]['sample_count'] = \
-                        get_sample_count(samples, app, task_id,
-                                         trailing_sample_index) + 1
-                    apps_details[app]['tasks'][task_id]['avg_cpu_util'] = \
-                        get_avg_resource_util(samples, app, task_id,
-                                              trailing_sample_index, cpu_util,
-                                              'avg_cpu_util')
-                    apps_details[app]['tasks'][task_id]['avg_mem_util'] = \
-                        get_avg_resource_util(samples, app, task_id,
-                                              trailing_sample_index, mem_util,
-                                              'avg_mem_util')
-                    apps_details[app]['cpu_util'] = \
-                        apps_details[app]['cpu_util'] + cpu_util
-                    apps_details[app]['mem_util'] = \
-                        apps_details[app]['mem_util'] + mem_util
-                    apps_details[app]['max_samples_in_app'] = \
-                        max(apps_details[app]['tasks'][task_id]['sample_count'],
-                            apps_details[app]['max_samples_in_app'])
-
-                apps_details[app]['cpu_util'] = \
-                    apps_details[app]['cpu_util'] / len(app_details['tasks'])
-                apps_details[app]['mem_util'] = \
-                    apps_details[app]['mem_util'] / len(app_details['tasks'])
-                apps_details[app]['task_count'] = len(app_details['tasks'])
+def poll_cycle():
+    # Run one poll cycle: collect the Apps and their statistics, update the
+    # samples and make the scaling decisions
+    cycle_start = time.time()
 
-            compute_app_averages(apps_details)
-            print_stats(apps_details)
+    if coordinator:
+        with profiler.span('coordination'):
+            coordinator.refresh()
 
-            trailing_sample_index = sample_index
+    with profiler.span('marathon'):
+        apps_details = get_marathon_apps_details()
+        if apps_details and coordinator:
+            apps_details = coordinator.partition(apps_details)
+    if not apps_details:
+        return
+
+    with profiler.span('agents'):
+        task_stats_index, stale_hosts = collect_task_statistics(apps_details)
+
+    # capture the raw cycle before sampling adds to it
+    if recorder:
+        with profiler.span('telemetry'):
+            agents = None
+            if capacity:
+                # the snapshot the scaling decisions of this cycle start from
+                capacity.refresh()
+                agents = capacity.free
+            recorder.write_cycle(cycle_start, apps_details, task_stats_index,
+                                 mesos.get_metrics(), stale_hosts, agents)
 
-            # store collected sample
-            samples[sample_index] = apps_details
+    process_cycle(apps_details, task_stats_index, cycle_start, stale_hosts)
 
-            scale_marathon_apps(samples[sample_index])
+    return apps_details
 
-            # increment rotating index
-            sample_index = (sample_index + 1) % MARATHON_SAMPLE_SIZE
+
+def marathon_poll():
+    # The first sample is taken straight away rather than after an interval,
+    # the scheduler picks when the next cycle starts
+    while True:
+        error = False
+        try:
+            profiler.begin_cycle()
+            poll_cycle()
 
         except Exception:
             traceback.print_exc()
-            time.sleep(MARATHON_POLL_INTERVAL)
+            metrics.inc('autoscaler_poll_errors_total')
+            error = True
+
+        finally:
+            profiler.end_cycle()
+
+        scheduler.completed(hot=any(app_heat.values()), error=error)
+        scheduler.wait()
 
 
 def update_config_with_env(config):
@@ -371,6 +825,167 @@ def update_config_with_env(config):
         config.mesos_user = os.getenv('MESOS_USER')
     if os.getenv('MESOS_PASS'):
         config.mesos_pass = os.getenv('MESOS_PASS')
+    if os.getenv('POLL_CONCURRENCY'):
+        config.poll_concurrency = int(os.getenv('POLL_CONCURRENCY'))
+    if os.getenv('PER_HOST_CONCURRENCY'):
+        config.per_host_concurrency = int(os.getenv('PER_HOST_CONCURRENCY'))
+    if os.getenv('MARATHON_BULK'):
+        config.marathon_bulk = os.getenv('MARATHON_BULK').lower() in \
+            ('1', 'yes', 'true', 'on')
+    if os.getenv('MARATHON_EVENTS'):
+        config.marathon_events = os.getenv('MARATHON_EVENTS').lower() in \
+            ('1', 'yes', 'true', 'on')
+    if os.getenv('AGENT_CACHE'):
+        config.agent_cache = os.getenv('AGENT_CACHE').lower() in \
+            ('1', 'yes', 'true', 'on')
+    if os.getenv('COLLECTOR_PROCESSES'):
+        config.collector_processes = int(os.getenv('COLLECTOR_PROCESSES'))
+    if os.getenv('STREAM_PARSING'):
+        config.stream_parsing = os.getenv('STREAM_PARSING').lower() in \
+            ('1', 'yes', 'true', 'on')
+    if os.getenv('COORDINATION'):
+        config.coordination = os.getenv('COORDINATION')
+    if os.getenv('COORDINATION_URL'):
+        config.coordination_url = os.getenv('COORDINATION_URL')
+    if os.getenv('FORECASTER'):
+        config.forecaster = os.getenv('FORECASTER')
+    if os.getenv('SCALING_BATCH_SIZE'):
+        config.scaling_batch_size = int(os.getenv('SCALING_BATCH_SIZE'))
+    if os.getenv('HTTP_SERVER'):
+        config.http_server = os.getenv('HTTP_SERVER')
+    if os.getenv('POLL_HOT_INTERVAL'):
+        config.poll_hot_interval = float(os.getenv('POLL_HOT_INTERVAL'))
+    if os.getenv('STATS_SOURCE'):
+        config.stats_source = os.getenv('STATS_SOURCE')
+    if os.getenv('AGENT_URL'):
+        config.agent_url = os.getenv('AGENT_URL')
+    if os.getenv('CAPACITY_PLANNER'):
+        config.capacity_planner = os.getenv('CAPACITY_PLANNER').lower() in \
+            ('1', 'yes', 'true', 'on')
+    if os.getenv('VECTORIZED'):
+        config.vectorized = os.getenv('VECTORIZED').lower() in \
+            ('1', 'yes', 'true', 'on')
+
+
+def new_transport(config, name, auth=None, pool_connections=1):
+    transport = Transport(auth=auth,
+                          connect_timeout=config.http_connect_timeout,
+                          read_timeout=config.http_read_timeout,
+                          retries=config.http_retries,
+                          backoff=config.http_backoff,
+                          pool_connections=pool_connections,
+                          pool_maxsize=config.per_host_concurrency,
+                          name=name)
+    transport.add_listener(observe_request)
+    transport.add_listener(profiler.record_request)
+    return transport
+
+
+def setup(autoscaler_config, sharded_collector=None):
+    # Build the clients and the state shared by the poll loop.
+    # sharded_collector is a collector whose workers were already forked
+    global config, metrics, profiler, marathon, mesos, agent_transport,\
+        deployments, samples, fanout, recorder, checkpoint, event_stream,\
+        agent_cache, app_heat, collector, coordinator, forecaster, history,\
+        policies, scheduler, stats_source, agent_directory, capacity
+
+    config = autoscaler_config
+
+    # fork the collector workers before any thread is started
+    collector = sharded_collector
+    if collector is None and config.collector_processes > 0:
+        collector = ShardedCollector(config, config.collector_processes)
+
+    metrics = Metrics(config.metrics_file)
+    describe_metrics()
+
+    # Apps near a threshold are only sampled faster than the others when
+    # the agent cache keeps the agents of the other Apps at their own pace
+    scheduler = PollScheduler(
+        interval=MARATHON_POLL_INTERVAL,
+        hot_interval=config.poll_hot_interval if config.agent_cache
+        else MARATHON_POLL_INTERVAL,
+        max_interval=config.poll_max_interval,
+        latency_budget=config.poll_latency_budget,
+        latency_factor=config.poll_latency_factor)
+
+    profiler = Profiler(json_logs=config.profiling_logs,
+                        profile_dir=config.profile_dir)
+
+    marathon = Marathon(config.marathon_url, marathon_user=config.marathon_user,
+                        marathon_pass=config.marathon_pass,
+                        transport=new_transport(config, 'marathon',
+                                                auth=(config.marathon_user,
+                                                      config.marathon_pass)))
+
+    mesos = Mesos(config.mesos_url, mesos_user=config.mesos_user,
+                  mesos_pass=config.mesos_pass,
+                  transport=new_transport(config, 'mesos',
+                                          auth=(config.mesos_user,
+                                                config.mesos_pass)),
+                  metrics_ttl=config.mesos_metrics_ttl)
+
+    capacity = None
+    if config.capacity_planner:
+        capacity = CapacityPlanner(mesos, ttl=config.mesos_metrics_ttl)
+
+    agent_transport = new_transport(config, 'agent', auth=agent_auth(config),
+                                    pool_connections=AGENT_POOLS)
+
+    if config.stats_source not in STATISTICS_SOURCES:
+        raise ValueError('unknown statistics source ' + config.stats_source)
+    stats_source = STATISTICS_SOURCES[config.stats_source]()
+    agent_directory = AgentDirectory(
+        mesos if config.agent_discovery else None, port=config.agent_port,
+        template=config.agent_url, mesos_url=config.mesos_url,
+        ttl=config.agent_discovery_ttl)
+
+    deployments = DeploymentTracker(marathon)
+
+    samples = SampleStore(MARATHON_SAMPLE_SIZE)
+
+    policies = PolicyIndex(default_policy(), config.policies)
+
+    checkpoint = None
+    if config.checkpoint_file:
+        checkpoint = Checkpoint(config.checkpoint_file)
+        print "Restored samples of {0} tasks from {1}".format(
+            checkpoint.load(samples, config.checkpoint_max_age),
+            config.checkpoint_file)
+
+    fanout = FanOut(concurrency=config.poll_concurrency,
+                    per_host_concurrency=config.per_host_concurrency)
+
+    app_heat = {}
+    agent_cache = None
+    if config.agent_cache:
+        agent_cache = AgentStatsCache(min_interval=MARATHON_POLL_INTERVAL,
+                                      max_interval=config.agent_max_interval)
+
+    event_stream = None
+    if config.marathon_events:
+        event_stream = MarathonEventStream(
+            marathon, resync_interval=config.marathon_resync_interval)
+        event_stream.start()
+
+    forecaster = None
+    history = UtilizationHistory(config.forecast_history)
+    if config.forecaster != 'none':
+        if config.forecaster not in FORECASTERS:
+            raise ValueError('unknown forecaster ' + config.forecaster)
+        forecaster = FORECASTERS[config.forecaster]()
+
+    coordinator = None
+    if config.coordination != 'none':
+        coordinator = Coordinator(
+            new_membership(config.coordination_url, instance_id(),
+                           config.coordination_ttl),
+            instance_id(), mode=config.coordination,
+            ttl=config.coordination_ttl)
+
+    recorder = None
+    if config.telemetry_file:
+        recorder = TelemetryWriter(config.telemetry_file)
 
 
 if __name__ == "__main__":
@@ -378,21 +993,36 @@ if __name__ == "__main__":
     config.load()
     update_config_with_env(config)
 
-    httpserver = HttpServer(debug=config.debug, listen_port=os.getenv('PORT0'))
-    httpserver_process = Process(target=httpserver.start)
-    httpserver_process.start()
-
-    marathon = Marathon(config.marathon_url, marathon_user=config.marathon_user,
-                        marathon_pass=config.marathon_pass)
+    # the collector workers must not inherit the health server's thread and
+    # listening socket, forking them only takes a moment
+    sharded_collector = None
+    if config.collector_processes > 0:
+        sharded_collector = ShardedCollector(config,
+                                             config.collector_processes)
+
+    # answer health checks before anything slow happens
+    httpserver_process = None
+    if config.http_server == 'flask':
+        from httpserver import HttpServer
+        httpserver = HttpServer(debug=config.debug,
+                                listen_port=os.getenv('PORT0'),
+                                metrics_file=config.metrics_file)
+        httpserver_process = Process(target=httpserver.start)
+        httpserver_process.start()
+    else:
+        httpserver = HealthServer(
+            listen_port=os.getenv('PORT0'), metrics_file=config.metrics_file,
+            on_profile=lambda: profiler.request_profile())
+        httpserver.start()
 
-    mesos = Mesos(config.mesos_url, mesos_user=config.mesos_user,
-                  mesos_pass=config.mesos_pass)
+    setup(config, sharded_collector)
 
     signal.signal(signal.SIGTERM, signal_handler)
     signal.signal(signal.SIGHUP, signal_handler)
     signal.signal(signal.SIGABRT, signal_handler)
     signal.signal(signal.SIGQUIT, signal_handler)
     signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGUSR1, profile_signal_handler)
 
     marathon_poll_thread = threading.Thread(target=marathon_poll)
     marathon_poll_thread.daemon = True
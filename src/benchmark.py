@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import urllib2
+import argparse
+import shutil
+import resource
+import tempfile
+import subprocess
+
+import autoscaler
+from config import Config
+from simulator import Trace, FakeCluster
+
+"""
+Runs the autoscaler poll cycle against the fake cluster in simulator.py and
+reports cycle latency, requests per cycle, memory and whether the scaling
+decisions match what the trace expects. Every cluster size is measured in its
+own process so memory figures don't leak from one size into the next.
+
+    python benchmark.py --tasks 10,1000,10000 --cycles 20
+    python benchmark.py --json > baseline.json
+    python benchmark.py --compare baseline.json
+    python benchmark.py --cold-start
+"""
+
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def write_config(f, port, options):
+    # Point a config at the fake cluster, options override [general] values
+    settings = {'debug': 'False',
+                'marathon_url': 'http://127.0.0.1:%d' % port,
+                'mesos_url': 'http://127.0.0.1:%d' % port,
+                'agent_port': str(port),
+                'metrics_file': ''}
+    settings.update(options)
+    f.write('[general]\n')
+    for name, value in sorted(settings.items()):
+        f.write('%s = %s\n' % (name, value))
+
+
+def make_config(port, options):
+    with tempfile.NamedTemporaryFile(suffix='.conf', delete=False) as f:
+        write_config(f, port, options)
+    config = Config(f.name)
+    config.load()
+    os.unlink(f.name)
+    return config
+
+
+def cluster_stats(port):
+    return json.load(urllib2.urlopen('http://127.0.0.1:%d/_sim/stats' % port))
+
+
+def request_count(stats):
+    return sum(count for endpoint, count in stats['requests'].items()
+               if not endpoint.startswith('GET /_sim'))
+
+
+def action_name(trace_app, data):
+    if 'instances' in data:
+        if data['instances'] > trace_app['instances']:
+            return 'instances_up'
+        return 'instances_down'
+    if data['mem'] > trace_app['mem']:
+        return 'mem_up'
+    return 'mem_down'
+
+
+def score(trace, actions):
+    # Compare the first action taken for every App with the expected one
+    taken = {}
+    for action in actions:
+        if action['app'] not in taken:
+            taken[action['app']] = action_name(trace.apps[action['app']],
+                                               action['data'])
+    correct = 0
+    missed = 0
+    unexpected = 0
+    for app, details in trace.apps.items():
+        if taken.get(app) == details['expected']:
+            correct = correct + 1
+        elif details['expected'] and app not in taken:
+            missed = missed + 1
+        else:
+            unexpected = unexpected + 1
+    return {'accuracy': float(correct) / len(trace.apps), 'missed': missed,
+            'unexpected': unexpected}
+
+
+def run(task_count, cycles, agents, port, options):
+    trace = Trace.synthetic(task_count)
+    cluster = FakeCluster(trace, port=port, agent_count=agents,
+                          deploy_delay=3600)
+    cluster.start()
+    devnull = open(os.devnull, 'w')
+    try:
+        autoscaler.setup(make_config(port, options))
+        start_rss = rss_bytes()
+        latencies = []
+        requests = []
+        before = request_count(cluster_stats(port))
+        for cycle in range(cycles):
+            start = time.time()
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                autoscaler.poll_cycle()
+            finally:
+                sys.stdout = stdout
+            latencies.append(time.time() - start)
+            after = request_count(cluster_stats(port))
+            requests.append(after - before)
+            before = after
+        stats = cluster_stats(port)
+        result = {'tasks': task_count, 'apps': len(trace.apps),
+                  'agents': agents, 'cycles': cycles,
+                  'latency_p50': sorted(latencies)[len(latencies) // 2],
+                  'latency_max': max(latencies),
+                  'requests_per_cycle': float(sum(requests)) / len(requests),
+                  'rss_mb': rss_bytes() / 1048576.0,
+                  'rss_growth_mb': (rss_bytes() - start_rss) / 1048576.0,
+                  'requests': stats['requests']}
+        result.update(score(trace, stats['actions']))
+        return result
+    finally:
+        autoscaler.fanout.close()
+        if autoscaler.collector:
+            autoscaler.collector.close()
+        cluster.stop()
+
+
+def cold_start(port, health_port, options, timeout=30):
+    # Launch autoscaler.py against the fake cluster the way Marathon does and
+    # time how long it takes to answer a health check and to ask an agent
+    # for its first sample
+    cluster = FakeCluster(Trace.synthetic(100), port=port, agent_count=8)
+    cluster.start()
+    workdir = tempfile.mkdtemp()
+    devnull = open(os.devnull, 'w')
+    try:
+        options = dict(options)
+        options.setdefault('metrics_file',
+                           os.path.join(workdir, 'autoscaler.prom'))
+        with open(os.path.join(workdir, Config.DEFAULT_CONFIG), 'w') as f:
+            write_config(f, port, options)
+        env = dict(os.environ, PORT0=str(health_port))
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'autoscaler.py')
+        start = time.time()
+        process = subprocess.Popen([sys.executable, script], cwd=workdir,
+                                   env=env, stdout=devnull, stderr=devnull)
+        health = None
+        first_sample = None
+        try:
+            while time.time() - start < timeout and \
+                    (health is None or first_sample is None):
+                if health is None:
+                    try:
+                        urllib2.urlopen('http://127.0.0.1:%d/' % health_port,
+                                        timeout=0.1)
+                        health = time.time() - start
+                    except Exception:
+                        pass
+                if first_sample is None and cluster_stats(port)['requests']\
+                        .get('GET /monitor/statistics.json'):
+                    first_sample = time.time() - start
+                time.sleep(0.005)
+        finally:
+            process.terminate()
+            process.wait()
+        return {'health_seconds': health, 'first_sample_seconds': first_sample}
+    finally:
+        cluster.stop()
+        shutil.rmtree(workdir)
+
+
+def run_in_subprocess(task_count, args):
+    command = [sys.executable, os.path.abspath(__file__),
+               '--single', str(task_count), '--cycles', str(args.cycles),
+               '--agents', str(args.agents), '--port', str(args.port)]
+    for option in args.set:
+        command.extend(['--set', option])
+    output = subprocess.check_output(command)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def compare(results, baseline, tolerance):
+    # Flag every size that got slower, chattier or less accurate than the
+    # baseline by more than tolerance
+    regressions = []
+    baseline = dict((result['tasks'], result) for result in baseline)
+    for result in results:
+        before = baseline.get(result['tasks'])
+        if not before:
+            continue
+        for key in ('latency_p50', 'requests_per_cycle', 'rss_mb'):
+            if result[key] > before[key] * (1 + tolerance):
+                regressions.append('%d tasks: %s %.4g -> %.4g' % (
+                    result['tasks'], key, before[key], result[key]))
+        if result['accuracy'] < before['accuracy']:
+            regressions.append('%d tasks: accuracy %.2f -> %.2f' % (
+                result['tasks'], before['accuracy'], result['accuracy']))
+    return regressions
+
+
+def print_results(results):
+    print "{0:>8} {1:>6} {2:>6} {3:>10} {4:>10} {5:>10} {6:>8} {7:>9}".format(
+        'Tasks', 'Apps', 'Agents', 'p50 (s)', 'max (s)', 'Req/cycle',
+        'RSS (MB)', 'Accuracy')
+    for result in results:
+        print "{0:>8} {1:>6} {2:>6} {3:>10.4f} {4:>10.4f} {5:>10.1f} "\
+            "{6:>8.1f} {7:>9.2%}".format(
+                result['tasks'], result['apps'], result['agents'],
+                result['latency_p50'], result['latency_max'],
+                result['requests_per_cycle'], result['rss_mb'],
+                result['accuracy'])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the poll cycle')
+    parser.add_argument('--tasks', default='10,1000,10000',
+                        help='comma separated task counts')
+    parser.add_argument('--cycles', type=int, default=20)
+    parser.add_argument('--agents', type=int, default=80)
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--set', action='append', default=[],
+                        help='override a config value, e.g. vectorized=false')
+    parser.add_argument('--json', action='store_true')
+    parser.add_argument('--compare', help='baseline written with --json')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--cold-start', action='store_true',
+                        help='time a fresh autoscaler.py to its first '
+                        'health check and sample')
+    parser.add_argument('--health-port', type=int, default=18081)
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    options = dict(option.split('=', 1) for option in args.set)
+    if args.cold_start:
+        result = cold_start(args.port, args.health_port, options)
+        if args.json:
+            print json.dumps(result)
+        else:
+            print "Health check after {0}s, first sample after {1}s".format(
+                *['%.3f' % result[key] if result[key] is not None
+                  else 'never' for key in ('health_seconds',
+                                           'first_sample_seconds')])
+        sys.exit(0)
+    if args.single is not None:
+        print json.dumps(run(args.single, args.cycles, args.agents, args.port,
+                             options))
+        sys.exit(0)
+
+    results = [run_in_subprocess(int(task_count), args)
+               for task_count in args.tasks.split(',')]
+    if args.json:
+        print json.dumps(results, indent=2)
+    else:
+        print_results(results)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print "Regression: " + regression
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,140 @@
+import time
+import bisect
+import threading
+import traceback
+
+"""
+Placement aware capacity for scale ups. The free CPUs and memory of the whole
+cluster say little about whether a task fits: 10 agents with 0.5 free CPUs
+each can't run a 1 CPU task, and a scale up Marathon can't place sits in a
+deployment waiting for offers that never come.
+
+The planner keeps the free resources of every active agent from the master's
+/slaves, refreshed at most once every ttl seconds, sorted by free CPUs with
+the largest free memory of every suffix next to them. Whether one more task
+fits is a bisection, whether several fit walks the agents with the most free
+CPUs until they are placed. Tasks planned in a cycle are placed on the agent
+that fits them most tightly and taken off its free resources until the next
+snapshot, the same way Mesos.reserve does for the cluster totals. Placement
+constraints of the Apps are not taken into account.
+
+The free resources of the last snapshot are kept as taken, before any task
+is planned on them, so a telemetry capture can record what the decisions of
+a cycle started from.
+"""
+
+
+def agent_free(slave):
+    # Free (cpus, mem) of an agent from its /slaves entry
+    resources = slave.get('resources', {})
+    used = slave.get('used_resources', {})
+    return (resources.get('cpus', 0.0) - used.get('cpus', 0.0),
+            resources.get('mem', 0.0) - used.get('mem', 0.0))
+
+
+class CapacityPlanner(object):
+
+    def __index(self, free):
+        # free is a list of (cpus, mem, agent id)
+        free.sort()
+        self.free = list(free)
+        self.cpus = [cpus for cpus, mem, agent in free]
+        self.mem = [mem for cpus, mem, agent in free]
+        self.agents = [agent for cpus, mem, agent in free]
+        self.max_mem = list(self.mem)
+        for i in range(len(self.max_mem) - 2, -1, -1):
+            self.max_mem[i] = max(self.mem[i], self.max_mem[i + 1])
+
+    def refresh(self, now=None):
+        # Take a new snapshot of the agents once the last one is ttl old
+        now = now or self.clock()
+        with self.lock:
+            if now - self.refreshed < self.ttl:
+                return
+            self.refreshed = now
+            try:
+                slaves = self.mesos.get_slaves()
+            except Exception:
+                traceback.print_exc()
+                self.snapshot = False
+                self.free = None
+                return
+            self.__index([agent_free(slave) + (slave['id'],)
+                          for slave in slaves if slave.get('active', True)])
+            self.snapshot = True
+
+    def __first_fit(self, cpus, mem):
+        # Index of the agent with the least free CPUs that fits a task, or
+        # None
+        i = bisect.bisect_left(self.cpus, cpus)
+        if i == len(self.cpus) or self.max_mem[i] < mem:
+            return None
+        while self.mem[i] < mem:
+            i = i + 1
+        return i
+
+    def fits(self, cpus, mem, count=1):
+        # Whether count more tasks of cpus and mem each fit on the agents.
+        # Without a snapshot the master could not be asked, which does not
+        # stop scaling
+        self.refresh()
+        with self.lock:
+            if not self.snapshot:
+                return True
+            if self.__first_fit(cpus, mem) is None:
+                return False
+            if count == 1:
+                return True
+            placed = 0
+            for i in range(len(self.cpus) - 1, -1, -1):
+                if self.cpus[i] < cpus:
+                    break
+                placed = placed + int(min(
+                    self.cpus[i] / cpus if cpus else count,
+                    self.mem[i] / mem if mem else count))
+                if placed >= count:
+                    return True
+            return False
+
+    def place(self, cpus, mem, count=1):
+        # Take count tasks of cpus and mem each off the free resources of the
+        # agents they fit most tightly on, return whether all of them fit
+        self.refresh()
+        with self.lock:
+            if not self.snapshot:
+                return True
+            for task in range(count):
+                i = self.__first_fit(cpus, mem)
+                if i is None:
+                    return False
+                free = (self.cpus.pop(i) - cpus, self.mem.pop(i) - mem,
+                        self.agents.pop(i))
+                j = bisect.bisect_left(self.cpus, free[0])
+                self.cpus.insert(j, free[0])
+                self.mem.insert(j, free[1])
+                self.agents.insert(j, free[2])
+                # only the suffixes starting at or before the old position
+                # change, and before the new one only until one is the same
+                self.max_mem.pop(i)
+                self.max_mem.insert(j, 0.0)
+                for k in range(i, -1, -1):
+                    max_mem = max(self.mem[k], self.max_mem[k + 1]) \
+                        if k + 1 < len(self.mem) else self.mem[k]
+                    if k < j and max_mem == self.max_mem[k]:
+                        break
+                    self.max_mem[k] = max_mem
+            return True
+
+    def __init__(self, mesos, ttl=5, clock=time.time):
+        # clock is the time snapshots age by, the capture's in a replay
+        self.mesos = mesos
+        self.ttl = ttl
+        self.clock = clock
+        self.refreshed = 0
+        self.snapshot = False
+        self.free = None
+        self.cpus = []
+        self.mem = []
+        self.agents = []
+        self.max_mem = []
+        self.lock = threading.Lock()
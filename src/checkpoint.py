@@ -0,0 +1,73 @@
+import time
+import sqlite3
+from array import array
+
+from samples import SampleStore
+
+
+class Checkpoint(object):
+    # Keeps a copy of the sample window in SQLite so a restarted autoscaler
+    # can carry on where it left off. Only the tasks that changed since the
+    # last save are written, the store only records them once load has
+    # attached it to a checkpoint
+
+    def save(self, samples):
+        dirty, evicted = samples.changes()
+        rows = []
+        for task_id in dirty:
+            slot = samples.slots.get(task_id)
+            if slot is None:
+                continue
+            window = array('d')
+            for name in SampleStore.COLUMNS:
+                window.extend(samples.window(task_id, name))
+            rows.append((task_id, samples.last(slot, 'timestamp'),
+                         samples.sample_count[slot],
+                         samples.avg_cpu_util[slot],
+                         samples.avg_mem_util[slot],
+                         sqlite3.Binary(window.tostring())))
+
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO samples VALUES '
+                                '(?, ?, ?, ?, ?, ?)', rows)
+            self.db.executemany('DELETE FROM samples WHERE task_id = ?',
+                                [(task_id,) for task_id in evicted])
+
+    def load(self, samples, max_age):
+        # Restore every task whose last sample is younger than max_age
+        # seconds and drop the rest
+        samples.tracking = True
+        oldest = time.time() - max_age
+        restored = 0
+        columns = len(SampleStore.COLUMNS)
+        with self.db:
+            self.db.execute('DELETE FROM samples WHERE timestamp < ?', (oldest,))
+        for task_id, sample_count, avg_cpu_util, avg_mem_util, blob in \
+                self.db.execute('SELECT task_id, sample_count, avg_cpu_util, '
+                                'avg_mem_util, window FROM samples'):
+            values = array('d')
+            values.fromstring(str(blob))
+            length = len(values) // columns
+            if not length:
+                continue
+            window = {}
+            for i, name in enumerate(SampleStore.COLUMNS):
+                window[name] = values[i * length:(i + 1) * length]
+            samples.restore(str(task_id), window, sample_count,
+                            avg_cpu_util, avg_mem_util)
+            restored = restored + 1
+        samples.changes()
+        return restored
+
+    def close(self):
+        self.db.close()
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS samples ('
+                        'task_id TEXT PRIMARY KEY, timestamp REAL, '
+                        'sample_count INTEGER, '
+                        'avg_cpu_util REAL, avg_mem_util REAL, window BLOB)')
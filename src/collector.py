@@ -0,0 +1,158 @@
+import zlib
+import signal
+import time
+import traceback
+from multiprocessing import Process, Pipe
+
+import jsonstream
+from fanout import FanOut
+from transport import Transport
+from jsonstream import STAT_FIELDS
+from statsource import STATISTICS_SOURCES, agent_auth
+
+"""
+Sharded collection of Mesos Agent statistics for clusters where parsing every
+agent's /monitor/statistics.json saturates the poll loop's core. Every worker
+process owns the agents whose name hashes to it, so its keep-alive connections
+stay warm across cycles, and sends back only the fields the sampling needs as
+one tuple per task. The coordinator rebuilds the statistics index from those
+summaries and runs the averaging and scaling decisions as usual. Agents are
+looked up in the coordinator, workers are sent the URL of every agent.
+"""
+
+
+def summarize(agent_stats):
+    # Compact executor_id -> tuple of STAT_FIELDS from an agent's statistics
+    summaries = {}
+    for executor_id, statistics in agent_stats.items():
+        if 'timestamp' not in statistics:
+            statistics['timestamp'] = time.time()
+        summaries[executor_id] = tuple(statistics.get(field, 0)
+                                       for field in STAT_FIELDS)
+    return summaries
+
+
+def expand(summaries):
+    # Inverse of summarize, in the shape returned by get_agent_statistics
+    return dict((executor_id, dict(zip(STAT_FIELDS, values)))
+                for executor_id, values in summaries.items())
+
+
+class Worker(object):
+    # Runs in the worker process, fetches and parses the agents it is sent
+
+    def fetch(self, target):
+        host, base_url = target
+        start = time.time()
+        try:
+            return host, summarize(self.source.fetch(
+                self.transport, base_url, self.stream)), 200, \
+                time.time() - start
+        except Exception:
+            traceback.print_exc()
+            return host, None, 'error', time.time() - start
+
+    def run(self, connection):
+        # the coordinator owns the signals, workers exit with it
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+        while True:
+            try:
+                targets = connection.recv()
+            except EOFError:
+                return
+            if targets is None:
+                return
+            connection.send(self.fanout.map(self.fetch, targets,
+                                            host=lambda target: target[0]))
+
+    def __init__(self, config, concurrency):
+        self.config = config
+        self.stream = config.stream_parsing and jsonstream.available()
+        self.source = STATISTICS_SOURCES[config.stats_source]()
+        self.transport = Transport(
+            auth=agent_auth(config),
+            connect_timeout=config.http_connect_timeout,
+            read_timeout=config.http_read_timeout,
+            retries=config.http_retries, backoff=config.http_backoff,
+            pool_connections=max(16, concurrency * 8),
+            pool_maxsize=config.per_host_concurrency, name='agent')
+        self.fanout = FanOut(concurrency=concurrency,
+                             per_host_concurrency=config.per_host_concurrency)
+
+
+class ShardedCollector(object):
+    # Coordinator side of the worker processes
+
+    def __start_worker(self, shard):
+        connection, worker_connection = Pipe()
+        process = Process(target=self.__run_worker, args=(worker_connection,))
+        process.daemon = True
+        process.start()
+        worker_connection.close()
+        self.workers[shard] = (process, connection)
+
+    def __run_worker(self, connection):
+        Worker(self.config, self.concurrency).run(connection)
+
+    def shard(self, host):
+        return zlib.crc32(host) % self.processes
+
+    def collect(self, targets):
+        # Return a list of (host, agent statistics or None, status, elapsed)
+        # for every (host, base URL) in the same order, fetched by the worker
+        # owning the host
+        hosts = [host for host, base_url in targets]
+        shards = {}
+        for target in targets:
+            shards.setdefault(self.shard(target[0]), []).append(target)
+
+        for shard, shard_targets in shards.items():
+            try:
+                self.workers[shard][1].send(shard_targets)
+            except (IOError, OSError, EOFError):
+                self.__restart(shard)
+                self.workers[shard][1].send(shard_targets)
+
+        results = {}
+        for shard, shard_targets in shards.items():
+            try:
+                shard_results = self.workers[shard][1].recv()
+            except (IOError, OSError, EOFError):
+                traceback.print_exc()
+                self.__restart(shard)
+                shard_results = [(host, None, 'error', 0.0)
+                                 for host, base_url in shard_targets]
+            for host, summaries, status, elapsed in shard_results:
+                results[host] = (host, None if summaries is None
+                                 else expand(summaries), status, elapsed)
+        return [results[host] for host in hosts]
+
+    def __restart(self, shard):
+        process, connection = self.workers[shard]
+        connection.close()
+        if process.is_alive():
+            process.terminate()
+        self.__start_worker(shard)
+
+    def close(self):
+        for process, connection in self.workers.values():
+            try:
+                connection.send(None)
+            except (IOError, OSError):
+                pass
+            connection.close()
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+        self.workers = {}
+
+    def __init__(self, config, processes):
+        # Start processes workers, splitting poll_concurrency between them
+        self.config = config
+        self.processes = processes
+        self.concurrency = max(1, config.poll_concurrency // processes)
+        self.workers = {}
+        for shard in range(processes):
+            self.__start_worker(shard)
@@ -3,6 +3,50 @@ import ConfigParser
 
 class Config:
     DEFAULT_CONFIG = "autoscaler.conf"
+    DEFAULTS = {'mesos_user': '',
+                'mesos_pass': '',
+                'marathon_user': '',
+                'marathon_pass': '',
+                'poll_concurrency': '16',
+                'per_host_concurrency': '4',
+                'marathon_bulk': 'true',
+                'http_connect_timeout': '3.05',
+                'http_read_timeout': '10',
+                'http_retries': '2',
+                'http_backoff': '0.3',
+                'mesos_metrics_ttl': '5',
+                'vectorized': 'true',
+                'metrics_file': '/tmp/autoscaler.prom',
+                'profiling_logs': 'false',
+                'profile_dir': '/tmp',
+                'agent_port': '5051',
+                'telemetry_file': '',
+                'checkpoint_file': '',
+                'checkpoint_max_age': '300',
+                'marathon_events': 'false',
+                'marathon_resync_interval': '60',
+                'agent_cache': 'false',
+                'agent_max_interval': '60',
+                'agent_staleness_budget': '30',
+                'collector_processes': '0',
+                'stream_parsing': 'false',
+                'coordination': 'none',
+                'coordination_url': '/tmp/autoscaler-coordination.db',
+                'coordination_ttl': '15',
+                'forecaster': 'none',
+                'forecast_history': '24',
+                'forecast_horizon': '0',
+                'scaling_batch_size': '50',
+                'http_server': 'builtin',
+                'poll_hot_interval': '2',
+                'poll_max_interval': '60',
+                'poll_latency_budget': '2',
+                'poll_latency_factor': '3',
+                'stats_source': 'legacy',
+                'agent_discovery': 'true',
+                'agent_discovery_ttl': '300',
+                'agent_url': '',
+                'capacity_planner': 'true'}
 
     def load(self):
         self.debug = self.config.getboolean('general', 'debug')
@@ -12,11 +56,84 @@ class Config:
         self.mesos_url = self.config.get('general', 'mesos_url')
         self.mesos_user = self.config.get('general', 'mesos_user')
         self.mesos_pass = self.config.get('general', 'mesos_pass')
+        self.poll_concurrency = self.config.getint('general',
+                                                   'poll_concurrency')
+        self.per_host_concurrency = self.config.getint('general',
+                                                       'per_host_concurrency')
+        self.marathon_bulk = self.config.getboolean('general', 'marathon_bulk')
+        self.http_connect_timeout = self.config.getfloat('general',
+                                                         'http_connect_timeout')
+        self.http_read_timeout = self.config.getfloat('general',
+                                                      'http_read_timeout')
+        self.http_retries = self.config.getint('general', 'http_retries')
+        self.http_backoff = self.config.getfloat('general', 'http_backoff')
+        self.mesos_metrics_ttl = self.config.getfloat('general',
+                                                      'mesos_metrics_ttl')
+        self.vectorized = self.config.getboolean('general', 'vectorized')
+        self.metrics_file = self.config.get('general', 'metrics_file')
+        self.profiling_logs = self.config.getboolean('general',
+                                                     'profiling_logs')
+        self.profile_dir = self.config.get('general', 'profile_dir')
+        self.agent_port = self.config.getint('general', 'agent_port')
+        self.telemetry_file = self.config.get('general', 'telemetry_file')
+        self.checkpoint_file = self.config.get('general', 'checkpoint_file')
+        self.checkpoint_max_age = self.config.getfloat('general',
+                                                       'checkpoint_max_age')
+        self.marathon_events = self.config.getboolean('general',
+                                                      'marathon_events')
+        self.marathon_resync_interval = self.config.getfloat(
+            'general', 'marathon_resync_interval')
+        self.agent_cache = self.config.getboolean('general', 'agent_cache')
+        self.agent_max_interval = self.config.getfloat('general',
+                                                       'agent_max_interval')
+        self.agent_staleness_budget = self.config.getfloat(
+            'general', 'agent_staleness_budget')
+        self.collector_processes = self.config.getint('general',
+                                                      'collector_processes')
+        self.stream_parsing = self.config.getboolean('general',
+                                                     'stream_parsing')
+        self.coordination = self.config.get('general', 'coordination')
+        self.coordination_url = self.config.get('general', 'coordination_url')
+        self.coordination_ttl = self.config.getfloat('general',
+                                                     'coordination_ttl')
+        self.forecaster = self.config.get('general', 'forecaster')
+        self.forecast_history = self.config.getint('general',
+                                                   'forecast_history')
+        self.forecast_horizon = self.config.getfloat('general',
+                                                     'forecast_horizon')
+        self.scaling_batch_size = self.config.getint('general',
+                                                     'scaling_batch_size')
+        self.http_server = self.config.get('general', 'http_server')
+        self.poll_hot_interval = self.config.getfloat('general',
+                                                      'poll_hot_interval')
+        self.poll_max_interval = self.config.getfloat('general',
+                                                      'poll_max_interval')
+        self.poll_latency_budget = self.config.getfloat('general',
+                                                        'poll_latency_budget')
+        self.poll_latency_factor = self.config.getfloat('general',
+                                                        'poll_latency_factor')
+        self.stats_source = self.config.get('general', 'stats_source')
+        self.agent_discovery = self.config.getboolean('general',
+                                                      'agent_discovery')
+        self.agent_discovery_ttl = self.config.getfloat('general',
+                                                        'agent_discovery_ttl')
+        # raw, the agent URL is a template with {} placeholders
+        self.agent_url = self.config.get('general', 'agent_url', raw=True)
+        self.capacity_planner = self.config.getboolean('general',
+                                                       'capacity_planner')
+
+        # [policy:<pattern>] sections in the order they are written, the
+        # values are parsed when the policies are compiled
+        self.policies = []
+        defaults = self.config.defaults()
+        for section in self.config.sections():
+            if section.startswith('policy:'):
+                self.policies.append((section[len('policy:'):], dict(
+                    (name, self.config.get(section, name, raw=True))
+                    for name in self.config.options(section)
+                    if name not in defaults)))
 
     def __init__(self, filename=DEFAULT_CONFIG):
         self.configFile = filename
-        self.config = ConfigParser.SafeConfigParser({'mesos_user': '',
-                                                     'mesos_pass': '',
-                                                     'marathon_user': '',
-                                                     'marathon_pass': ''})
+        self.config = ConfigParser.SafeConfigParser(Config.DEFAULTS)
         self.config.read(filename)
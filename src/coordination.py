@@ -0,0 +1,217 @@
+import os
+import time
+import socket
+import sqlite3
+import hashlib
+import urlparse
+import traceback
+
+"""
+Coordination of several autoscaler instances running side by side.
+
+In leader mode every instance keeps sampling so a standby can take over
+straight away, but only the holder of the leader lease submits scaling
+actions. In partition mode every App is owned by exactly one live instance,
+picked by rendezvous hashing so only the Apps of an instance that joins or
+leaves move, and every instance only collects and scales the Apps it owns.
+An instance holds off scaling an App until it has owned it for a whole lease,
+by which time the previous owner has either noticed the change or expired.
+
+Membership and the leader lease live in a SQLite file on storage shared by
+the instances, or in ZooKeeper when a zk:// url is given. An instance that
+cannot import kazoo or reach ZooKeeper when it starts warns and falls back to
+the SQLite file at FALLBACK_PATH, which is only shared by instances on the
+same host: instances on other hosts then each lead on their own. Run more
+than one instance, e.g. raise the instances of scripts/deploy.json, only
+once ZooKeeper is reachable from every agent and kazoo is installed.
+"""
+
+LEADER = 'leader'
+PARTITION = 'partition'
+FALLBACK_PATH = '/tmp/autoscaler-coordination.db'
+
+
+def instance_id():
+    # Marathon gives every task a unique id, fall back to host and pid
+    return os.getenv('MESOS_TASK_ID') or \
+        '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+class SQLiteMembership(object):
+    # Members and the leader lease as rows that expire ttl seconds after
+    # their last heartbeat. Every change runs in an immediate transaction so
+    # the instances sharing the file never race each other
+
+    def heartbeat(self, now=None):
+        # Renew this instance and return the ids of every live instance
+        now = now or time.time()
+        with self.db:
+            self.db.execute('BEGIN IMMEDIATE')
+            self.db.execute('INSERT OR REPLACE INTO members VALUES (?, ?)',
+                            (self.instance_id, now))
+            self.db.execute('DELETE FROM members WHERE heartbeat < ?',
+                            (now - self.ttl,))
+            return sorted(str(row[0]) for row in
+                          self.db.execute('SELECT instance_id FROM members'))
+
+    def acquire_leadership(self, now=None):
+        # Take or renew the leader lease, return whether this instance holds
+        # it until now + ttl
+        now = now or time.time()
+        with self.db:
+            self.db.execute('BEGIN IMMEDIATE')
+            self.db.execute('INSERT OR IGNORE INTO leader VALUES (0, ?, ?)',
+                            (self.instance_id, now + self.ttl))
+            self.db.execute('UPDATE leader SET holder = ?, expires = ? '
+                            'WHERE holder = ? OR expires < ?',
+                            (self.instance_id, now + self.ttl,
+                             self.instance_id, now))
+            holder = self.db.execute('SELECT holder FROM leader').fetchone()
+        return holder[0] == self.instance_id
+
+    def leave(self):
+        with self.db:
+            self.db.execute('BEGIN IMMEDIATE')
+            self.db.execute('DELETE FROM members WHERE instance_id = ?',
+                            (self.instance_id,))
+            self.db.execute('DELETE FROM leader WHERE holder = ?',
+                            (self.instance_id,))
+        self.db.close()
+
+    def __init__(self, path, instance_id, ttl):
+        self.instance_id = instance_id
+        self.ttl = ttl
+        self.db = sqlite3.connect(path, timeout=ttl, isolation_level=None,
+                                  check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS members '
+                        '(instance_id TEXT PRIMARY KEY, heartbeat REAL)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS leader '
+                        '(id INTEGER PRIMARY KEY, holder TEXT, expires REAL)')
+
+
+class ZooKeeperMembership(object):
+    # Members are ephemeral nodes that go away with the session of their
+    # instance, the leader is the owner of the lowest election node
+
+    def __register(self):
+        member = self.path + '/members/' + self.instance_id
+        if not self.client.exists(member):
+            self.client.create(member, ephemeral=True, makepath=True)
+        if not self.election_node or \
+                not self.client.exists(self.election_node):
+            self.election_node = self.client.create(
+                self.path + '/election/n-', value=self.instance_id,
+                ephemeral=True, sequence=True, makepath=True)
+
+    def heartbeat(self, now=None):
+        self.__register()
+        return sorted(self.client.get_children(self.path + '/members'))
+
+    def acquire_leadership(self, now=None):
+        self.__register()
+        nodes = sorted(self.client.get_children(self.path + '/election'))
+        return bool(nodes) and \
+            self.election_node == self.path + '/election/' + nodes[0]
+
+    def leave(self):
+        self.client.stop()
+        self.client.close()
+
+    def __init__(self, hosts, path, instance_id, ttl):
+        self.instance_id = instance_id
+        self.path = path.rstrip('/') or '/autoscaler'
+        self.election_node = None
+        # only imported when ZooKeeper is used, it is slow to import
+        from kazoo.client import KazooClient
+        self.client = KazooClient(hosts=hosts, timeout=ttl)
+        self.client.start(timeout=ttl)
+
+
+def new_membership(url, instance_id, ttl):
+    # zk://host:port,host:port/path or the path of a SQLite file
+    if url.startswith('zk://'):
+        parsed = urlparse.urlparse(url)
+        try:
+            return ZooKeeperMembership(parsed.netloc, parsed.path,
+                                       instance_id, ttl)
+        except Exception:
+            traceback.print_exc()
+            print "WARNING: ZooKeeper at {0} is unavailable, coordinating " \
+                "through {1} instead, only instances on this host share " \
+                "it".format(url, FALLBACK_PATH)
+            url = FALLBACK_PATH
+    return SQLiteMembership(url, instance_id, ttl)
+
+
+def rendezvous_owner(app, members):
+    # The member with the highest hash of (member, app) owns the App
+    return max(members,
+               key=lambda member: hashlib.md5(member + '/' + app).digest())
+
+
+class Coordinator(object):
+    def refresh(self, now=None):
+        # Heartbeat and pick up membership changes, called once per cycle.
+        # An instance that cannot heartbeat owns nothing and does not lead
+        now = now or time.time()
+        try:
+            members = self.membership.heartbeat(now)
+            if self.mode == LEADER:
+                self.leader = self.membership.acquire_leadership(now)
+        except Exception:
+            traceback.print_exc()
+            members = []
+            self.leader = False
+        if self.instance_id not in members:
+            members = []
+        if members != self.members:
+            self.members = members
+            self.owners = {}
+        self.refreshed = now
+
+    def owns(self, app, now=None):
+        # Whether this instance collects the App
+        if self.mode != PARTITION:
+            return True
+        if app not in self.owners:
+            self.owners[app] = rendezvous_owner(app, self.members) \
+                if self.members else None
+        if self.owners[app] != self.instance_id:
+            self.owned_since.pop(app, None)
+            return False
+        self.owned_since.setdefault(app, now or time.time())
+        return True
+
+    def may_scale(self, app, now=None):
+        # Whether this instance may submit scaling actions for the App
+        now = now or time.time()
+        if self.mode == LEADER:
+            return self.leader and now - self.refreshed < self.ttl
+        return self.owns(app, now) and \
+            now - self.owned_since[app] >= self.ttl and \
+            now - self.refreshed < self.ttl
+
+    def partition(self, apps_details, now=None):
+        # The Apps this instance collects this cycle
+        now = now or time.time()
+        for app in set(self.owned_since).difference(apps_details):
+            del self.owned_since[app]
+        return dict((app, app_details)
+                    for app, app_details in apps_details.items()
+                    if self.owns(app, now))
+
+    def close(self):
+        self.membership.leave()
+
+    def __init__(self, membership, instance_id, mode=LEADER, ttl=15):
+        if mode not in (LEADER, PARTITION):
+            raise ValueError('unknown coordination mode ' + mode)
+        self.membership = membership
+        self.instance_id = instance_id
+        self.mode = mode
+        self.ttl = ttl
+        self.members = []
+        self.owners = {}
+        self.owned_since = {}
+        self.leader = False
+        self.refreshed = 0
@@ -0,0 +1,67 @@
+import time
+import threading
+
+
+class DeploymentTracker(object):
+    def track(self, app, deployment_id):
+        with self.lock:
+            self.in_flight[app] = (deployment_id, self.clock())
+            self.scaled[app] = self.clock()
+
+    def refresh(self):
+        # Fetch the deployments once and index them by id, then retire every
+        # tracked deployment that Marathon no longer reports
+        # Return the Apps whose deployment was retired
+        deployments = self.marathon.get_deployments()
+
+        active = set()
+        busy_apps = set()
+        for deployment in deployments:
+            active.add(deployment['id'])
+            for app in deployment.get('affectedApps', []):
+                busy_apps.add(app.strip('/'))
+
+        retired = []
+        with self.lock:
+            self.busy_apps = busy_apps
+            for app, (deployment_id, started) in self.in_flight.items():
+                if deployment_id in active:
+                    continue
+                del self.in_flight[app]
+                self.durations.append(self.clock() - started)
+                retired.append(app)
+                print "Scaled " + app
+            del self.durations[:-self.max_durations]
+        return retired
+
+    def expected_duration(self, default):
+        # Median of the recent deployment durations, default until one has
+        # finished
+        with self.lock:
+            if not self.durations:
+                return default
+            return sorted(self.durations)[len(self.durations) // 2]
+
+    def since_scaled(self, app):
+        # Seconds since the last deployment of an App was submitted
+        with self.lock:
+            return self.clock() - self.scaled.get(app, 0)
+
+    def is_deploying(self, app):
+        with self.lock:
+            return app in self.in_flight or app in self.busy_apps
+
+    def get_deploying_count(self):
+        with self.lock:
+            return len(self.in_flight)
+
+    def __init__(self, marathon, max_durations=32, clock=time.time):
+        # clock is the time decisions are made at, the capture's in a replay
+        self.marathon = marathon
+        self.clock = clock
+        self.in_flight = {}
+        self.busy_apps = set()
+        self.scaled = {}
+        self.durations = []
+        self.max_durations = max_durations
+        self.lock = threading.Lock()
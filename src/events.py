@@ -0,0 +1,134 @@
+import json
+import time
+import copy
+import threading
+import traceback
+
+TASK_RUNNING = 'TASK_RUNNING'
+TASK_GONE = ('TASK_FINISHED', 'TASK_FAILED', 'TASK_KILLED', 'TASK_LOST',
+             'TASK_ERROR', 'TASK_GONE', 'TASK_DROPPED', 'TASK_UNREACHABLE',
+             'TASK_GONE_BY_OPERATOR', 'TASK_UNKNOWN')
+
+
+class MarathonEventStream(object):
+    # Keeps a live index of the Apps, their tasks and hosts by following the
+    # Marathon event stream in a background thread. Task status updates are
+    # applied in place, Apps touched by a deployment or an API change are
+    # refetched on the next read and everything is resynced every
+    # resync_interval seconds to catch anything the stream missed
+
+    def __apply(self, event_type, event):
+        with self.lock:
+            if event_type == 'status_update_event':
+                app = event['appId'].strip('/')
+                if app not in self.apps or self.apps[app] is None:
+                    self.dirty_apps.add(app)
+                    return
+                tasks = self.apps[app]['tasks']
+                if event['taskStatus'] == TASK_RUNNING:
+                    tasks[str(event['taskId'])] = {'host': str(event['host'])}
+                elif event['taskStatus'] in TASK_GONE:
+                    tasks.pop(str(event['taskId']), None)
+            elif event_type == 'app_terminated_event':
+                self.apps.pop(event['appId'].strip('/'), None)
+            elif event_type == 'api_post_event':
+                self.dirty_apps.add(event['appDefinition']['id'].strip('/'))
+            elif event_type in ('deployment_info', 'deployment_success',
+                                'deployment_failed'):
+                plan = event.get('plan', event)
+                for step in plan.get('steps', []):
+                    for action in step.get('actions', []):
+                        self.dirty_apps.add(action['app'].strip('/'))
+
+    def __consume(self):
+        response = self.marathon.get_events(read_timeout=self.resync_interval)
+        self.connected = True
+        event_type = None
+        data = []
+        for line in response.iter_lines():
+            if self.stopped:
+                break
+            if line.startswith('event:'):
+                event_type = line[len('event:'):].strip()
+            elif line.startswith('data:'):
+                data.append(line[len('data:'):].strip())
+            elif not line and data:
+                try:
+                    event = json.loads('\n'.join(data))
+                    self.__apply(event.get('eventType', event_type), event)
+                except Exception:
+                    traceback.print_exc()
+                event_type = None
+                data = []
+
+    def __run(self):
+        backoff = 1
+        while not self.stopped:
+            try:
+                self.__consume()
+                backoff = 1
+            except Exception:
+                traceback.print_exc()
+            # anything could have happened while disconnected
+            self.connected = False
+            self.synced = 0
+            if not self.stopped:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+
+    def __resync(self):
+        apps_details = self.marathon.get_all_app_details() or {}
+        with self.lock:
+            self.apps = apps_details
+            self.dirty_apps = set()
+            self.synced = time.time()
+
+    def __refresh_dirty(self):
+        with self.lock:
+            dirty_apps = self.dirty_apps
+            self.dirty_apps = set()
+        for app in dirty_apps:
+            try:
+                app_details = self.marathon.get_app_details(app)
+            except Exception:
+                # gone or unreachable, the next resync will sort it out
+                app_details = None
+            with self.lock:
+                self.apps[app] = app_details
+
+    def get_apps_details(self):
+        # Return a copy of the index in the shape of
+        # Marathon.get_all_app_details for the poll cycle to work on
+        if not self.connected or \
+                time.time() - self.synced >= self.resync_interval:
+            self.__resync()
+        else:
+            self.__refresh_dirty()
+
+        with self.lock:
+            apps_details = {}
+            for app, app_details in self.apps.items():
+                if app_details and app_details['tasks']:
+                    apps_details[app] = copy.deepcopy(app_details)
+                else:
+                    apps_details[app] = None
+            return apps_details
+
+    def start(self):
+        self.thread = threading.Thread(target=self.__run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+
+    def __init__(self, marathon, resync_interval=60):
+        self.marathon = marathon
+        self.resync_interval = resync_interval
+        self.apps = {}
+        self.dirty_apps = set()
+        self.synced = 0
+        self.connected = False
+        self.stopped = False
+        self.lock = threading.Lock()
+        self.thread = None
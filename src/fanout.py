@@ -0,0 +1,46 @@
+import threading
+from multiprocessing.pool import ThreadPool
+
+
+class FanOut(object):
+    def __host_semaphore(self, host):
+        with self.lock:
+            if host not in self.host_semaphores:
+                self.host_semaphores[host] = \
+                    threading.BoundedSemaphore(self.per_host_concurrency)
+            return self.host_semaphores[host]
+
+    def __call(self, call):
+        func, item, host = call
+        if host is None:
+            return func(item)
+
+        # Never have more than per_host_concurrency requests in flight
+        # against a single endpoint
+        with self.__host_semaphore(host):
+            return func(item)
+
+    def map(self, func, items, host=None):
+        # Run func against every item on the pool and return the results in
+        # the same order as items. host maps an item to the endpoint it talks
+        # to so that per host limits can be applied
+        items = list(items)
+        if not items:
+            return []
+
+        calls = []
+        for item in items:
+            calls.append((func, item, host(item) if host else None))
+
+        return self.pool.map(self.__call, calls)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __init__(self, concurrency=16, per_host_concurrency=4):
+        self.concurrency = concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.host_semaphores = {}
+        self.lock = threading.Lock()
+        self.pool = ThreadPool(concurrency)
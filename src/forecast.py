@@ -0,0 +1,97 @@
+from collections import deque
+
+"""
+Forecasting of App utilization so capacity can be asked for before an App
+saturates rather than after. The poll loop keeps a short history of the
+utilization of every App and asks a forecaster where it will be one
+deployment ahead. Every forecaster implements
+
+    forecast(times, values, horizon)
+
+returning the value expected horizon seconds after the last of the samples,
+which are given oldest first. A forecast only brings a scale up forward when
+it is above the current value, so every forecaster follows the trend: a
+smoothed level alone lags behind a rise and stays above a fall.
+"""
+
+
+class Holt(object):
+    # Holt's linear trend: a smoothed level plus a smoothed trend per second
+
+    def forecast(self, times, values, horizon):
+        level = values[0]
+        trend = 0.0
+        for i in range(1, len(values)):
+            elapsed = times[i] - times[i - 1]
+            if elapsed <= 0:
+                continue
+            previous = level
+            level = self.alpha * values[i] + \
+                (1 - self.alpha) * (level + trend * elapsed)
+            trend = self.beta * (level - previous) / elapsed + \
+                (1 - self.beta) * trend
+        return level + trend * horizon
+
+    def __init__(self, alpha=0.5, beta=0.3):
+        self.alpha = alpha
+        self.beta = beta
+
+
+class Slope(object):
+    # Least squares line through the whole history
+
+    def forecast(self, times, values, horizon):
+        count = float(len(values))
+        mean_time = sum(times) / count
+        mean_value = sum(values) / count
+        variance = sum((t - mean_time) ** 2 for t in times)
+        if not variance:
+            return mean_value
+        slope = sum((t - mean_time) * (v - mean_value)
+                    for t, v in zip(times, values)) / variance
+        return mean_value + slope * (times[-1] + horizon - mean_time)
+
+
+FORECASTERS = {'holt': Holt, 'slope': Slope}
+
+
+class UtilizationHistory(object):
+    # The last size (timestamp, cpu_util, mem_util) samples of every App
+
+    def record(self, app, timestamp, cpu_util, mem_util):
+        if app not in self.apps:
+            self.apps[app] = deque(maxlen=self.size)
+        self.apps[app].append((timestamp, cpu_util, mem_util))
+
+    def series(self, app):
+        # Return the timestamps, CPU and memory utilization of an App, oldest
+        # first
+        history = self.apps.get(app, ())
+        return ([sample[0] for sample in history],
+                [sample[1] for sample in history],
+                [sample[2] for sample in history])
+
+    def reset(self, app):
+        self.apps.pop(app, None)
+
+    def prune(self, apps):
+        # Forget the Apps that are gone
+        for app in set(self.apps).difference(apps):
+            del self.apps[app]
+
+    def __init__(self, size=24):
+        self.size = size
+        self.apps = {}
+
+
+if __name__ == "__main__":
+    # Every forecaster sees a rise coming and no rise in a fall
+    times = [0, 5, 10, 15, 20]
+    rising = [0.5, 0.6, 0.7, 0.8, 0.85]
+    falling = [0.95, 0.95, 0.95, 0.95, 0.7]
+    for name, forecaster in sorted(FORECASTERS.items()):
+        ahead = forecaster().forecast(times, rising, 30)
+        assert ahead > rising[-1], (name, 'rising', ahead)
+        ahead = forecaster().forecast(times, falling, 30)
+        assert ahead <= falling[-1], (name, 'falling', ahead)
+        print name, 'ok'
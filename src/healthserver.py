@@ -0,0 +1,72 @@
+import threading
+import SocketServer
+import BaseHTTPServer
+
+
+class HealthServer(object):
+    # Answers the same routes as HttpServer from a thread of the poll
+    # process. It only needs the standard library, so it is up before the
+    # rest of the autoscaler is set up and health checks pass straight away
+
+    def __handler(self):
+        server = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def __respond(self, status, body, content_type='text/html'):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == '/':
+                    self.__respond(200, 'Hello World!')
+                elif self.path == '/metrics':
+                    # Serve the last snapshot published by the poll loop
+                    try:
+                        with open(server.metrics_file) as f:
+                            body = f.read()
+                    except (IOError, TypeError):
+                        body = ''
+                    self.__respond(200, body,
+                                   'text/plain; version=0.0.4')
+                else:
+                    self.__respond(404, 'Not Found')
+
+            def do_POST(self):
+                if self.path != '/profile':
+                    self.__respond(404, 'Not Found')
+                    return
+                try:
+                    server.on_profile()
+                except Exception:
+                    self.__respond(503, 'Not ready\n')
+                    return
+                self.__respond(200, 'Profiling next poll cycle\n')
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self.server = Server(('0.0.0.0', self.port), self.__handler())
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __init__(self, listen_port=5000, metrics_file=None, on_profile=None):
+        self.port = int(listen_port or 5000)
+        self.metrics_file = metrics_file
+        self.on_profile = on_profile
+        self.server = None
+        self.thread = None
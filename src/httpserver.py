@@ -1,4 +1,7 @@
-from flask import Flask
+import os
+import signal
+
+from flask import Flask, Response
 app = Flask("autoscaler")
 
 
@@ -7,9 +10,26 @@ class HttpServer:
     def hello():
         return "Hello World!"
 
+    @app.route("/metrics")
+    def metrics():
+        # Serve the last snapshot published by the poll loop
+        try:
+            with open(app.config['METRICS_FILE']) as f:
+                body = f.read()
+        except (IOError, KeyError, TypeError):
+            body = ''
+        return Response(body, mimetype='text/plain; version=0.0.4')
+
+    @app.route("/profile", methods=['POST'])
+    def profile():
+        # Ask the poll loop in the parent process to profile its next cycle
+        os.kill(os.getppid(), signal.SIGUSR1)
+        return "Profiling next poll cycle\n"
+
     def start(self):
         app.run(host='0.0.0.0', port=self.port, debug=self.debug)
 
-    def __init__(self, debug=False, listen_port=5000):
+    def __init__(self, debug=False, listen_port=5000, metrics_file=None):
         self.debug = debug
         self.port = listen_port
+        app.config['METRICS_FILE'] = metrics_file
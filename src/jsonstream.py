@@ -0,0 +1,97 @@
+import json
+import importlib
+
+# The pure Python backend of ijson is far too slow to be worth streaming with
+ijson = None
+for backend in ('yajl2_c', 'yajl2_cffi'):
+    try:
+        ijson = importlib.import_module('ijson.backends.' + backend)
+        break
+    except (ImportError, OSError):
+        pass
+
+"""
+Field selective parsing of Mesos Agent statistics. /monitor/statistics.json
+runs to several MB on dense agents while the sampling only needs a handful of
+fields per executor.
+
+By default the body is parsed with the standard library and every object is
+cut down to STAT_FIELDS as soon as it is parsed, so the rest of each
+executor's statistics is freed straight away instead of living until the end
+of the cycle. That is also a little cheaper than keeping everything.
+
+With stream parsing enabled and ijson with a yajl backend installed, the body
+is parsed as it is read off the socket and the whole document never exists in
+memory, not even as text. It costs several times the CPU of the standard
+library parser, so it is only worth it where memory is the constraint.
+"""
+
+STAT_FIELDS = ('timestamp', 'cpus_system_time_secs', 'cpus_user_time_secs',
+               'mem_rss_bytes', 'mem_limit_bytes')
+KEEP = frozenset(STAT_FIELDS + ('executor_id', 'statistics'))
+CONTAINER_KEEP = KEEP.union(('get_containers', 'containers',
+                             'resource_statistics', 'value'))
+STATISTICS_PREFIX = 'item.statistics.'
+
+
+def available():
+    return ijson is not None
+
+
+def stream_statistics(stream):
+    agent_stats = {}
+    executor_id = None
+    statistics = {}
+    for prefix, event, value in ijson.parse(stream):
+        if prefix == 'item.executor_id':
+            executor_id = value
+        elif prefix.startswith(STATISTICS_PREFIX):
+            field = prefix[len(STATISTICS_PREFIX):]
+            if field in KEEP:
+                statistics[field] = float(value)
+        elif prefix == 'item' and event == 'end_map':
+            if executor_id is not None:
+                agent_stats[executor_id] = statistics
+            executor_id = None
+            statistics = {}
+    return agent_stats
+
+
+def select_fields(pairs):
+    return dict((key, value) for key, value in pairs if key in KEEP)
+
+
+def select_container_fields(pairs):
+    return dict((key, value) for key, value in pairs
+                if key in CONTAINER_KEEP)
+
+
+def agent_statistics(response, stream=False):
+    # Return a dict of executor_id to the STAT_FIELDS of its statistics from
+    # a /monitor/statistics.json response. stream must match the stream
+    # argument the request was made with
+    if stream:
+        try:
+            response.raw.decode_content = True
+            return stream_statistics(response.raw)
+        finally:
+            response.close()
+
+    agent_stats = {}
+    for task in json.loads(response.content, object_pairs_hook=select_fields):
+        agent_stats[task['executor_id']] = task['statistics']
+    return agent_stats
+
+
+def container_statistics(response):
+    # Same as agent_statistics from a v1 operator API GET_CONTAINERS response,
+    # containers without an executor or without statistics are skipped
+    agent_stats = {}
+    containers = json.loads(response.content,
+                            object_pairs_hook=select_container_fields)
+    for container in containers['get_containers'].get('containers', []):
+        if 'executor_id' in container and \
+                'resource_statistics' in container:
+            agent_stats[container['executor_id']['value']] = \
+                container['resource_statistics']
+    return agent_stats
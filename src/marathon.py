@@ -1,41 +1,20 @@
 import sys
 import json
-import time
-import requests
+
+from transport import Transport
 
 
 class Marathon(object):
     def __requests_get(self, uri):
-        response = None
-        if self.marathon_user:
-            # print "User " + self.marathon_user + "Pass " + self.marathon_pass
-            # print "URI " + self.marathon_host + uri
-            response = requests.get(self.marathon_host + uri,
-                                    verify=False,
-                                    auth=(self.marathon_user,
-                                          self.marathon_pass))
-        else:
-            response = requests.get(self.marathon_host + uri,
-                                    verify=False)
+        response = self.transport.get(self.marathon_host + uri)
 
         # print "Response: " + str(response)
         return response.json()
 
     def __requests_put(self, uri, data, headers):
-        if self.marathon_user:
-            # print "User " + self.marathon_user + "Pass " + self.marathon_pass
-            # print "URI " + self.marathon_host + uri
-            response = requests.put(self.marathon_host + uri, data,
-                                    headers=headers,
-                                    verify=False,
-                                    auth=(self.marathon_user,
-                                          self.marathon_pass))
-        else:
-            response = requests.put(self.marathon_host + uri,
-                                    data,
-                                    headers=headers,
-                                    verify=False)
-            # print "Response:" + str(response)
+        response = self.transport.put(self.marathon_host + uri, data,
+                                      headers=headers)
+        # print "Response:" + str(response)
         return response
 
     def get_all_apps(self):
@@ -52,22 +31,21 @@ class Marathon(object):
             self.apps = apps
             return apps
 
-    def get_app_details(self, marathon_app):
-        response = self.__requests_get('/v2/apps/' + marathon_app)
-
-        if (response['app']['tasks'] == []):
+    def __app_details(self, marathon_app, app):
+        if (app['tasks'] == []):
             print "No task data on Marathon for App !" + marathon_app
         else:
-            app_instances = response['app']['instances']
+            app_instances = app['instances']
             self.appinstances = app_instances
             # print "App '" + marathon_app + "' has " +\
             #    str(self.appinstances) + " instances deployed"
             app_task_dict = {}
             app_task_dict['tasks'] = {}
-            app_task_dict['mem'] = response['app']['mem']
-            app_task_dict['cpus'] = response['app']['cpus']
+            app_task_dict['mem'] = app['mem']
+            app_task_dict['cpus'] = app['cpus']
+            app_task_dict['labels'] = app.get('labels') or {}
 
-            for task in response['app']['tasks']:
+            for task in app['tasks']:
                 task_id = task['id']
                 hostid = task['host']
 
@@ -78,18 +56,47 @@ class Marathon(object):
 
             return app_task_dict
 
-    def wait_until_deployed(self, response):
-        deployed = False
-        while not deployed:
-            deployments = self.__requests_get('/v2/deployments')
-            if deployments == []:
-                deployed = True
-                return
-            for deployment in deployments:
-                if deployment['id'] == response['deploymentId']:
-                    time.sleep(5)
-                    continue
-            deployed = True
+    def get_app_details(self, marathon_app):
+        response = self.__requests_get('/v2/apps/' + marathon_app)
+
+        return self.__app_details(marathon_app, response['app'])
+
+    def get_all_app_details(self):
+        # Fetch the details of every App in a single request by having
+        # Marathon embed the tasks. Older Marathons ignore the embed so fall
+        # back to a single /v2/tasks request and group the tasks by App
+        response = self.__requests_get('/v2/apps?embed=apps.tasks')
+
+        if response['apps'] == []:
+            print "No Apps found on Marathon"
+            return
+
+        if any('tasks' not in i for i in response['apps']):
+            app_tasks = {}
+            for task in self.__requests_get('/v2/tasks')['tasks']:
+                app_tasks.setdefault(task['appId'].strip('/'), []).append(task)
+            for i in response['apps']:
+                i['tasks'] = app_tasks.get(i['id'].strip('/'), [])
+
+        apps = []
+        apps_details = {}
+        for i in response['apps']:
+            appid = i['id'].strip('/')
+            apps.append(appid)
+            apps_details[appid] = self.__app_details(appid, i)
+        self.apps = apps
+        return apps_details
+
+    def get_events(self, read_timeout=None):
+        # Open the server sent event stream, the caller reads it line by line
+        return self.transport.get(self.marathon_host + '/v2/events',
+                                  stream=True,
+                                  headers={'Accept': 'text/event-stream'},
+                                  timeout=(self.transport.timeout[0],
+                                           read_timeout))
+
+    def get_deployments(self):
+        return self.__requests_get('/v2/deployments')
 
     def scale_app_instances(self, marathon_app, target_instance_count):
 
@@ -106,11 +113,8 @@ class Marathon(object):
         print "Scaling " + marathon_app + " with instances = " +\
             str(target_instance_count)
 
-        # Wait until app changes are deployed
-        self.wait_until_deployed(response.json())
-        print "Scaled " + marathon_app
-
-        return True
+        # Hand back the deployment so it can be tracked without blocking
+        return response.json()['deploymentId']
 
     def scale_app_mem(self, marathon_app, target_mem_size):
 
@@ -126,14 +130,33 @@ class Marathon(object):
 
         print "Scaling " + marathon_app + " with mem = " + str(target_mem_size)
 
-        # Wait until app changes are deployed
-        self.wait_until_deployed(response.json())
-        print "Scaled " + marathon_app
+        # Hand back the deployment so it can be tracked without blocking
+        return response.json()['deploymentId']
+
+    def scale_apps(self, updates):
+        # Apply partial definitions of several Apps, each with its 'id', in
+        # a single deployment
+        json_data = json.dumps(updates)
+        headers = {'Content-type': 'application/json'}
+        response = self.__requests_put('/v2/apps', json_data, headers=headers)
+        if response.status_code != 200:
+            sys.stderr.write("Unable to scale in bulk, got response: " +
+                             str(response.status_code) + "\n")
+            return False
+
+        for update in updates:
+            print "Scaling " + update['id'].strip('/') + " with " + \
+                ", ".join("%s = %s" % (key, value)
+                          for key, value in sorted(update.items())
+                          if key != 'id')
 
-        return True
+        return response.json()['deploymentId']
 
-    def __init__(self, marathon_host, marathon_user=None, marathon_pass=None):
+    def __init__(self, marathon_host, marathon_user=None, marathon_pass=None,
+                 transport=None):
         self.name = marathon_host
         self.marathon_user = marathon_user
         self.marathon_pass = marathon_pass
         self.marathon_host = (marathon_host)
+        self.transport = transport or Transport(auth=(marathon_user,
+                                                      marathon_pass))
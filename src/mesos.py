@@ -1,50 +1,66 @@
-import requests
+import time
+import threading
+
+from transport import Transport
 
 
 class Mesos(object):
     def __requests_get(self, uri):
-        response = None
-        if self.mesos_user:
-            # print "User " + self.mesos_user + "Pass " + self.mesos_pass
-            # print "URI " + self.mesos_host + uri
-            response = requests.get(self.mesos_host + uri,
-                                    verify=False,
-                                    auth=(self.mesos_user,
-                                          self.mesos_pass))
-        else:
-            response = requests.get(self.mesos_host + uri,
-                                    verify=False)
+        response = self.transport.get(self.mesos_host + uri)
 
         # print "Response: " + str(response)
         return response.json()
 
     def __requests_put(self, uri, data, headers):
-        if self.mesos_user:
-            # print "User " + self.mesos_user + "Pass " + self.mesos_pass
-            # print "URI " + self.mesos_host + uri
-            response = requests.put(self.mesos_host + uri, data,
-                                    headers=headers,
-                                    verify=False,
-                                    auth=(self.mesos_user,
-                                          self.mesos_pass))
-        else:
-            response = requests.put(self.mesos_host + uri,
-                                    data,
-                                    headers=headers,
-                                    verify=False)
-            # print "Response:" + str(response)
+        response = self.transport.put(self.mesos_host + uri, data,
+                                      headers=headers)
+        # print "Response:" + str(response)
         return response.json()
 
+    def get_metrics(self):
+        # Serve the master metrics from a snapshot that is refreshed at most
+        # once every metrics_ttl seconds. Local reservations only apply to
+        # the snapshot they were made against
+        with self.lock:
+            if self.metrics is None or \
+                    time.time() - self.metrics_time >= self.metrics_ttl:
+                self.metrics = self.__requests_get('/metrics/snapshot')
+                self.metrics_time = time.time()
+                self.reserved_cpus = 0.0
+                self.reserved_mem = 0.0
+            return self.metrics
+
+    def get_slaves(self):
+        # The agents registered with the master
+        return self.__requests_get('/slaves')['slaves']
+
+    def reserve(self, cpus=0.0, mem=0.0):
+        # Subtract resources committed by a scaling decision from the cached
+        # free pool so later decisions in the same cycle don't reuse them
+        with self.lock:
+            self.reserved_cpus = self.reserved_cpus + cpus
+            self.reserved_mem = self.reserved_mem + mem
+
     def get_mem_free(self):
-        metrics = self.__requests_get('/metrics/snapshot')
-        return metrics['master/mem_total'] - metrics['master/mem_used']
+        metrics = self.get_metrics()
+        return metrics['master/mem_total'] - metrics['master/mem_used'] -\
+            self.reserved_mem
 
     def get_cpus_free(self):
-        metrics = self.__requests_get('/metrics/snapshot')
-        return metrics['master/cpus_total'] - metrics['master/cpus_used']
+        metrics = self.get_metrics()
+        return metrics['master/cpus_total'] - metrics['master/cpus_used'] -\
+            self.reserved_cpus
 
-    def __init__(self, mesos_host, mesos_user=None, mesos_pass=None):
+    def __init__(self, mesos_host, mesos_user=None, mesos_pass=None,
+                 transport=None, metrics_ttl=5):
         self.name = mesos_host
         self.mesos_user = mesos_user
         self.mesos_pass = mesos_pass
         self.mesos_host = (mesos_host)
+        self.transport = transport or Transport(auth=(mesos_user, mesos_pass))
+        self.metrics_ttl = metrics_ttl
+        self.metrics = None
+        self.metrics_time = 0
+        self.reserved_cpus = 0.0
+        self.reserved_mem = 0.0
+        self.lock = threading.Lock()
@@ -0,0 +1,101 @@
+import os
+import threading
+
+
+class Metrics(object):
+    # Prometheus style registry. The poll loop records into it and renders
+    # a text snapshot once per cycle, which is handed to the http server
+    # process by atomically replacing a file so scrapes never take the lock
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+               30.0)
+
+    def __key(self, labels):
+        if not labels:
+            return ()
+        return tuple(sorted(labels.items()))
+
+    def __format_labels(self, key, extra=()):
+        pairs = list(key) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(
+            '%s="%s"' % (name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+            for name, value in pairs) + '}'
+
+    def describe(self, name, metric_type, help_text):
+        with self.lock:
+            self.types[name] = metric_type
+            self.help[name] = help_text
+            self.series.setdefault(name, {})
+
+    def set(self, name, value, labels=None):
+        with self.lock:
+            self.series.setdefault(name, {})[self.__key(labels)] = value
+
+    def inc(self, name, value=1, labels=None):
+        key = self.__key(labels)
+        with self.lock:
+            series = self.series.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, labels=None):
+        key = self.__key(labels)
+        with self.lock:
+            series = self.series.setdefault(name, {})
+            if key not in series:
+                series[key] = [[0] * len(Metrics.BUCKETS), 0.0, 0]
+            histogram = series[key]
+            for i, bound in enumerate(Metrics.BUCKETS):
+                if value <= bound:
+                    histogram[0][i] = histogram[0][i] + 1
+            histogram[1] = histogram[1] + value
+            histogram[2] = histogram[2] + 1
+
+    def clear(self, name):
+        with self.lock:
+            self.series[name] = {}
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name in sorted(self.series):
+                metric_type = self.types.get(name, 'gauge')
+                if name in self.help:
+                    lines.append('# HELP %s %s' % (name, self.help[name]))
+                lines.append('# TYPE %s %s' % (name, metric_type))
+                for key, value in sorted(self.series[name].items()):
+                    if metric_type != 'histogram':
+                        lines.append('%s%s %r' % (
+                            name, self.__format_labels(key), float(value)))
+                        continue
+                    buckets, total, count = value
+                    for bound, bucket in zip(Metrics.BUCKETS, buckets):
+                        lines.append('%s_bucket%s %d' % (
+                            name, self.__format_labels(key, (('le', bound),)),
+                            bucket))
+                    lines.append('%s_bucket%s %d' % (
+                        name, self.__format_labels(key, (('le', '+Inf'),)),
+                        count))
+                    lines.append('%s_sum%s %r' % (
+                        name, self.__format_labels(key), total))
+                    lines.append('%s_count%s %d' % (
+                        name, self.__format_labels(key), count))
+        return '\n'.join(lines) + '\n'
+
+    def publish(self):
+        # Write the snapshot next to the target and rename it into place so
+        # a reader always sees a complete file
+        if not self.path:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.rename(tmp_path, self.path)
+
+    def __init__(self, path=None):
+        self.path = path
+        self.types = {}
+        self.help = {}
+        self.series = {}
+        self.lock = threading.Lock()
@@ -0,0 +1,50 @@
+class ScalingPlan(object):
+    # The scaling actions decided in one poll cycle. They are submitted
+    # together as bulk PUT /v2/apps updates of up to batch_size Apps each, so
+    # a surge turns into a handful of Marathon deployments instead of one per
+    # App. Marathon rejects a whole bulk update if any of its Apps is locked
+    # by a deployment, so a rejected batch is retried one App at a time
+
+    def add(self, app, app_details, action, data):
+        # data is the partial App definition to apply, e.g. {'instances': 3}
+        self.actions[app] = (app_details, action, data)
+
+    def __contains__(self, app):
+        return app in self.actions
+
+    def __len__(self):
+        return len(self.actions)
+
+    def __scale_app(self, marathon, app, data):
+        if 'instances' in data:
+            return marathon.scale_app_instances(app, data['instances'])
+        return marathon.scale_app_mem(app, data['mem'])
+
+    def submit(self, marathon):
+        # Return (app, app_details, action, deployment_id) of every action
+        # Marathon accepted
+        submitted = []
+        apps = sorted(self.actions)
+        for start in range(0, len(apps), self.batch_size):
+            batch = apps[start:start + self.batch_size]
+            deployment_id = None
+            if len(batch) > 1:
+                updates = []
+                for app in batch:
+                    update = dict(self.actions[app][2])
+                    update['id'] = '/' + app
+                    updates.append(update)
+                deployment_id = marathon.scale_apps(updates)
+            for app in batch:
+                app_details, action, data = self.actions[app]
+                app_deployment_id = deployment_id or \
+                    self.__scale_app(marathon, app, data)
+                if app_deployment_id:
+                    submitted.append((app, app_details, action,
+                                      app_deployment_id))
+        self.actions = {}
+        return submitted
+
+    def __init__(self, batch_size=50):
+        self.batch_size = max(1, batch_size)
+        self.actions = {}
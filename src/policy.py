@@ -0,0 +1,145 @@
+import re
+import fnmatch
+
+"""
+Per App scaling policies. A policy is the set of thresholds and limits the
+scaling decisions of an App are made with. Apps start from the default
+policy, built from the autoscaler settings, which is then overridden by the
+[policy:<pattern>] sections of autoscaler.conf that match the App id and
+last by the App's own Marathon labels, e.g.
+
+    [policy:payments/*]
+    max_cpu_threshold = 0.7
+    sample_size = 2
+    cooldown = 30
+
+    "labels": {"autoscaler.max_instances": "20"}
+
+A pattern without wildcards matches one App, a pattern ending in a single *
+matches every App under a prefix and anything else is a shell style glob.
+Several sections can match an App: globs apply first in the order they are
+written, then prefixes from the shortest to the longest and then the exact
+match, so the most specific section wins.
+"""
+
+LABEL_PREFIX = 'autoscaler.'
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    if value.lower() in ('1', 'yes', 'true', 'on'):
+        return True
+    if value.lower() in ('0', 'no', 'false', 'off'):
+        return False
+    raise ValueError('not a boolean: ' + value)
+
+
+class Policy(object):
+    # max_instances of 0 means no limit
+    FIELDS = {'min_instances': int,
+              'max_instances': int,
+              'min_cpu_threshold': float,
+              'max_cpu_threshold': float,
+              'min_mem_threshold': float,
+              'max_mem_threshold': float,
+              'mem_scale': float,
+              'sample_size': int,
+              'cooldown': float,
+              'enabled': parse_bool}
+
+    @staticmethod
+    def parse(settings):
+        # Convert setting strings to typed values, raises ValueError on an
+        # unknown setting or a malformed value
+        values = {}
+        for name, value in settings.items():
+            if name not in Policy.FIELDS:
+                raise ValueError('unknown policy setting ' + name)
+            values[name] = Policy.FIELDS[name](value)
+        return values
+
+    def derive(self, values):
+        # Return a copy of this policy with some values replaced
+        fields = dict((name, getattr(self, name)) for name in Policy.FIELDS)
+        fields.update(values)
+        return Policy(**fields)
+
+    def __init__(self, min_instances, max_instances, min_cpu_threshold,
+                 max_cpu_threshold, min_mem_threshold, max_mem_threshold,
+                 mem_scale, sample_size, cooldown=0, enabled=True):
+        self.min_instances = min_instances
+        self.max_instances = max_instances
+        self.min_cpu_threshold = min_cpu_threshold
+        self.max_cpu_threshold = max_cpu_threshold
+        self.min_mem_threshold = min_mem_threshold
+        self.max_mem_threshold = max_mem_threshold
+        self.mem_scale = mem_scale
+        self.sample_size = sample_size
+        self.cooldown = cooldown
+        self.enabled = enabled
+
+
+class PolicyIndex(object):
+    # The policy sections compiled once into an exact match dict, a list of
+    # prefixes and a list of compiled globs. The policy of every App is
+    # cached along with the labels it was derived from and only derived
+    # again when those labels change
+
+    def __match(self, app):
+        values = {}
+        for pattern, glob_values in self.globs:
+            if pattern.match(app):
+                values.update(glob_values)
+        for prefix, prefix_values in self.prefixes:
+            if app.startswith(prefix):
+                values.update(prefix_values)
+        values.update(self.exact.get(app, {}))
+        return values
+
+    def lookup(self, app, labels=None):
+        # Return the policy of an App given its Marathon labels
+        labels = dict((name[len(LABEL_PREFIX):], value)
+                      for name, value in (labels or {}).items()
+                      if name.startswith(LABEL_PREFIX))
+        cached = self.cache.get(app)
+        if cached and cached[0] == labels:
+            return cached[1]
+
+        values = self.__match(app)
+        for name, value in labels.items():
+            try:
+                values.update(Policy.parse({name: value}))
+            except ValueError as e:
+                print "Ignoring label {0}{1} of {2}: {3}".format(
+                    LABEL_PREFIX, name, app, e)
+        policy = self.default.derive(values) if values else self.default
+        self.cache[app] = (labels, policy)
+        return policy
+
+    def prune(self, apps):
+        # Forget the Apps that are gone
+        for app in set(self.cache).difference(apps):
+            del self.cache[app]
+
+    def __init__(self, default, sections=()):
+        # sections is a list of (pattern, settings) in the order they are
+        # written in, settings maps setting names to strings
+        self.default = default
+        self.exact = {}
+        self.prefixes = []
+        self.globs = []
+        self.cache = {}
+        for pattern, settings in sections:
+            values = Policy.parse(settings)
+            pattern = pattern.strip('/')
+            wildcards = re.search(r'[*?\[]', pattern)
+            if not wildcards:
+                self.exact[pattern] = values
+            elif pattern.endswith('*') and wildcards.start() == \
+                    len(pattern) - 1:
+                self.prefixes.append((pattern[:-1], values))
+            else:
+                self.globs.append((re.compile(fnmatch.translate(pattern)),
+                                   values))
+        self.prefixes.sort(key=lambda prefix: len(prefix[0]))
@@ -0,0 +1,105 @@
+import os
+import json
+import time
+import pstats
+import cProfile
+import threading
+from collections import deque
+from contextlib import contextmanager
+from urlparse import urlparse
+
+
+class Profiler(object):
+    # Records how long each phase of a poll cycle and every outbound request
+    # takes, keeps a rolling window of them to summarize as percentiles and
+    # optionally logs each one as a JSON line
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def record(self, name, duration, **fields):
+        with self.lock:
+            if name not in self.windows:
+                self.windows[name] = deque(maxlen=self.window_size)
+            self.windows[name].append(duration)
+
+        if self.json_logs:
+            record = {'type': 'span', 'name': name,
+                      'duration': round(duration, 6),
+                      'time': time.time()}
+            record.update(fields)
+            print json.dumps(record, sort_keys=True)
+
+    @contextmanager
+    def span(self, name, **fields):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, time.time() - start, **fields)
+
+    def record_request(self, name, method, url, response, elapsed):
+        # Transport listener, one record per outbound request
+        fields = {'type': 'request', 'client': name, 'method': method,
+                  'host': urlparse(url).netloc, 'endpoint': urlparse(url).path}
+        if response is not None:
+            fields['status'] = response.status_code
+            fields['bytes'] = response.raw.tell() if response.raw else 0
+        else:
+            fields['status'] = 'error'
+        self.record('request.' + name, elapsed, **fields)
+
+    def summary(self):
+        # Rolling p50/p95/p99 of every span and request type
+        summary = {}
+        with self.lock:
+            windows = [(name, sorted(window))
+                       for name, window in self.windows.items()]
+        for name, durations in windows:
+            if not durations:
+                continue
+            summary[name] = {'count': len(durations)}
+            for quantile in Profiler.QUANTILES:
+                index = min(int(quantile * len(durations)),
+                            len(durations) - 1)
+                summary[name]['p%d' % (quantile * 100)] = durations[index]
+        return summary
+
+    def request_profile(self, cycles=1):
+        # Safe to call from a signal handler, the poll loop picks it up at
+        # the start of its next cycle
+        self.profile_requested = cycles
+
+    def begin_cycle(self):
+        if self.profile_requested and not self.profile:
+            self.profile = cProfile.Profile()
+            self.profile_cycles = self.profile_requested
+            self.profile_requested = 0
+            self.profile.enable()
+
+    def end_cycle(self):
+        if self.json_logs:
+            print json.dumps({'type': 'summary', 'time': time.time(),
+                              'spans': self.summary()}, sort_keys=True)
+
+        if not self.profile:
+            return
+        self.profile_cycles = self.profile_cycles - 1
+        if self.profile_cycles > 0:
+            return
+
+        self.profile.disable()
+        path = os.path.join(self.profile_dir,
+                            'autoscaler-%d.prof' % int(time.time()))
+        self.profile.dump_stats(path)
+        print "Wrote poll cycle profile to " + path
+        pstats.Stats(self.profile).sort_stats('cumulative').print_stats(20)
+        self.profile = None
+
+    def __init__(self, window_size=1000, json_logs=False, profile_dir='/tmp'):
+        self.window_size = window_size
+        self.json_logs = json_logs
+        self.profile_dir = profile_dir
+        self.windows = {}
+        self.lock = threading.Lock()
+        self.profile = None
+        self.profile_cycles = 0
+        self.profile_requested = 0
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import autoscaler
+from config import Config
+from mesos import Mesos
+from metrics import Metrics
+from profiling import Profiler
+from samples import SampleStore
+from deployments import DeploymentTracker
+from telemetry import TelemetryReader
+from capacity import CapacityPlanner
+from forecast import FORECASTERS, UtilizationHistory
+from policy import PolicyIndex
+
+"""
+Replays a telemetry capture through the autoscaler's sampling and scaling
+decisions without touching the network, e.g. to try out thresholds against a
+week of production history:
+
+    python replay.py capture.astl --set MARATHON_MAX_CPU_THRESHOLD=0.8
+
+Scale ups are placed on the free resources of the agents captured with each
+cycle. Cycles captured without them, by an autoscaler running without the
+capacity planner, replay without the placement check, and the report tells
+how many cycles that applies to.
+"""
+
+
+class ReplayMarathon(object):
+    # Stands in for Marathon, records scaling actions and treats every
+    # deployment as finished deploy_time seconds after it was submitted
+
+    def __scale(self, updates):
+        # updates is a list of (marathon_app, data) deployed together
+        self.deployment_serial = self.deployment_serial + 1
+        deployment_id = 'replay-%d' % self.deployment_serial
+        self.deployments[deployment_id] = ([app for app, data in updates],
+                                           self.now + self.deploy_time)
+        for marathon_app, data in updates:
+            self.actions.append({'time': self.now, 'app': marathon_app,
+                                 'data': data})
+        return deployment_id
+
+    def scale_app_instances(self, marathon_app, target_instance_count):
+        return self.__scale([(marathon_app,
+                              {'instances': target_instance_count})])
+
+    def scale_app_mem(self, marathon_app, target_mem_size):
+        return self.__scale([(marathon_app, {'mem': target_mem_size})])
+
+    def scale_apps(self, updates):
+        return self.__scale([(update['id'].strip('/'),
+                              dict((key, value)
+                                   for key, value in update.items()
+                                   if key != 'id'))
+                             for update in updates])
+
+    def get_deployments(self):
+        return [{'id': deployment_id,
+                 'affectedApps': ['/' + app for app in apps]}
+                for deployment_id, (apps, done) in self.deployments.items()
+                if done > self.now]
+
+    def __init__(self, deploy_time=60):
+        self.deploy_time = deploy_time
+        self.now = 0
+        self.actions = []
+        self.deployments = {}
+        self.deployment_serial = 0
+
+
+class ReplayMesos(Mesos):
+    # Serves the master metrics and agents captured with each cycle
+
+    def get_metrics(self):
+        with self.lock:
+            if self.metrics is not self.snapshot:
+                self.metrics = self.snapshot
+                self.reserved_cpus = 0.0
+                self.reserved_mem = 0.0
+            return self.metrics
+
+    def get_slaves(self):
+        return [{'id': agent, 'resources': {'cpus': cpus, 'mem': mem}}
+                for cpus, mem, agent in self.agents]
+
+    def __init__(self):
+        Mesos.__init__(self, 'replay')
+        self.snapshot = None
+        self.agents = []
+
+
+def load_config(filename):
+    config = Config(filename)
+    if not config.config.has_section('general'):
+        config.config.add_section('general')
+    for name, value in (('debug', 'false'), ('marathon_url', ''),
+                        ('mesos_url', ''), ('metrics_file', ''),
+                        ('telemetry_file', ''), ('checkpoint_file', '')):
+        config.config.set('general', name, value)
+    config.load()
+    return config
+
+
+def setup(config, deploy_time):
+    autoscaler.config = config
+    autoscaler.metrics = Metrics()
+    autoscaler.describe_metrics()
+    autoscaler.profiler = Profiler()
+    autoscaler.marathon = ReplayMarathon(deploy_time=deploy_time)
+    autoscaler.mesos = ReplayMesos()
+    autoscaler.deployments = DeploymentTracker(
+        autoscaler.marathon, clock=lambda: autoscaler.marathon.now)
+    autoscaler.samples = SampleStore(autoscaler.MARATHON_SAMPLE_SIZE)
+    autoscaler.policies = PolicyIndex(autoscaler.default_policy(),
+                                      config.policies)
+    autoscaler.recorder = None
+    autoscaler.checkpoint = None
+    autoscaler.agent_cache = None
+    autoscaler.collector = None
+    autoscaler.coordinator = None
+    autoscaler.scheduler = None
+    autoscaler.capacity = None
+    if config.capacity_planner:
+        autoscaler.capacity = CapacityPlanner(
+            autoscaler.mesos, ttl=config.mesos_metrics_ttl,
+            clock=lambda: autoscaler.marathon.now)
+    autoscaler.history = UtilizationHistory(config.forecast_history)
+    autoscaler.forecaster = None
+    if config.forecaster != 'none':
+        autoscaler.forecaster = FORECASTERS[config.forecaster]()
+    autoscaler.app_heat = {}
+
+
+def replay(path, start=None, end=None, speed=0, verbose=False):
+    marathon = autoscaler.marathon
+    mesos = autoscaler.mesos
+    capacity = autoscaler.capacity
+    devnull = open(os.devnull, 'w')
+    cycles = 0
+    placed_cycles = 0
+    first = None
+    last = None
+    replay_start = time.time()
+
+    for cycle, timestamp, payload in TelemetryReader(path).cycles(start, end):
+        if speed and last is not None:
+            time.sleep(max(0.0, timestamp - last) / speed)
+        first = timestamp if first is None else first
+        last = timestamp
+        cycles = cycles + 1
+
+        marathon.now = timestamp
+        mesos.snapshot = payload['master']
+        # without captured agents scale ups are not checked for placement
+        mesos.agents = payload.get('agents')
+        autoscaler.capacity = capacity if mesos.agents is not None else None
+        if autoscaler.capacity:
+            placed_cycles = placed_cycles + 1
+        stdout = sys.stdout
+        if not verbose:
+            sys.stdout = devnull
+        try:
+            autoscaler.process_cycle(payload['apps'], payload['stats'],
+                                     time.time(), payload.get('stale'),
+                                     timestamp)
+        finally:
+            sys.stdout = stdout
+
+    elapsed = time.time() - replay_start
+    return {'cycles': cycles,
+            'captured_seconds': (last - first) if cycles else 0,
+            'replay_seconds': elapsed,
+            'speedup': ((last - first) / elapsed) if cycles and elapsed else 0,
+            'placed_cycles': placed_cycles,
+            'actions': marathon.actions}
+
+
+def print_report(report):
+    print "Replayed {0} cycles covering {1:.0f}s in {2:.2f}s ({3:.0f}x)"\
+        .format(report['cycles'], report['captured_seconds'],
+                report['replay_seconds'], report['speedup'])
+    if report['placed_cycles'] < report['cycles']:
+        print "Placement not modelled in {0} cycles captured without " \
+            "agents".format(report['cycles'] - report['placed_cycles'])
+    counts = {}
+    for action in report['actions']:
+        kind = ', '.join('%s=%s' % item for item in action['data'].items())
+        print "{0:.0f} {1:<32.32} {2}".format(action['time'], action['app'],
+                                               kind)
+        name = action['data'].keys()[0]
+        counts[name] = counts.get(name, 0) + 1
+    print "Scaling actions: {0} ({1})".format(
+        len(report['actions']),
+        ', '.join('%s: %d' % item for item in sorted(counts.items())))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replay a telemetry capture')
+    parser.add_argument('capture')
+    parser.add_argument('--config', default=Config.DEFAULT_CONFIG)
+    parser.add_argument('--set', action='append', default=[],
+                        help='override a threshold, e.g. '
+                        'MARATHON_MAX_CPU_THRESHOLD=0.8')
+    parser.add_argument('--start', type=float, help='first timestamp')
+    parser.add_argument('--end', type=float, help='last timestamp')
+    parser.add_argument('--speed', type=float, default=0,
+                        help='times real speed, 0 replays as fast as possible')
+    parser.add_argument('--deploy-time', type=float, default=60,
+                        help='seconds a replayed deployment takes')
+    parser.add_argument('--verbose', action='store_true')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    for option in args.set:
+        name, value = option.split('=', 1)
+        if not hasattr(autoscaler, name):
+            parser.error('unknown setting ' + name)
+        setattr(autoscaler, name, type(getattr(autoscaler, name))(value))
+
+    setup(load_config(args.config), args.deploy_time)
+    report = replay(args.capture, start=args.start, end=args.end,
+                    speed=args.speed, verbose=args.verbose)
+    if args.json:
+        print json.dumps(report, indent=2)
+    else:
+        print_report(report)
@@ -0,0 +1,188 @@
+from array import array
+
+
+class SampleStore(object):
+    # Ring buffer of the last window_size samples of every task. Each task
+    # owns a slot, and every windowed metric is a flat array of doubles
+    # holding window_size values per slot, so memory stays flat no matter
+    # how many tasks come and go
+    COLUMNS = ('timestamp', 'cpus_time', 'cpu_util', 'mem_util')
+
+    def __grow(self, capacity):
+        extra = capacity - self.capacity
+        if extra <= 0:
+            return
+        for name in SampleStore.COLUMNS:
+            self.columns[name].extend([0.0] * (extra * self.window_size))
+        self.head.extend([0] * extra)
+        self.length.extend([0] * extra)
+        self.last_cycle.extend([-1] * extra)
+        self.sample_count.extend([0] * extra)
+        self.avg_cpu_util.extend([0.0] * extra)
+        self.avg_mem_util.extend([0.0] * extra)
+        self.free_slots.extend(range(capacity - 1, self.capacity - 1, -1))
+        self.capacity = capacity
+
+    def __allocate(self, task_id):
+        if not self.free_slots:
+            self.__grow(max(self.capacity * 2, 1))
+        slot = self.free_slots.pop()
+        self.head[slot] = self.window_size - 1
+        self.length[slot] = 0
+        self.sample_count[slot] = 0
+        self.avg_cpu_util[slot] = 0.0
+        self.avg_mem_util[slot] = 0.0
+        self.slots[task_id] = slot
+        self.tasks[slot] = task_id
+        return slot
+
+    def __evict(self, slot):
+        task_id = self.tasks.pop(slot)
+        del self.slots[task_id]
+        self.last_cycle[slot] = -1
+        self.free_slots.append(slot)
+        if self.tracking:
+            self.dirty.discard(task_id)
+            self.evicted.add(task_id)
+
+    def prior(self, task_id):
+        # Return the slot of a task that was sampled in the last committed
+        # cycle, or None when there is no prior sample to compare against
+        slot = self.slots.get(task_id)
+        if slot is None or self.last_cycle[slot] != self.cycle:
+            return None
+        return slot
+
+    def last(self, slot, name):
+        # Latest value of a windowed column or of a per task running value
+        if name in self.columns:
+            return self.columns[name][slot * self.window_size +
+                                      self.head[slot]]
+        return getattr(self, name)[slot]
+
+    def window(self, task_id, name):
+        # Values of a windowed column for a task, oldest first
+        slot = self.slots.get(task_id)
+        if slot is None:
+            return []
+        column = self.columns[name]
+        base = slot * self.window_size
+        length = self.length[slot]
+        head = self.head[slot]
+        return [column[base + (head - i) % self.window_size]
+                for i in range(length - 1, -1, -1)]
+
+    def append(self, task_id, task_details):
+        slot = self.slots.get(task_id)
+        if slot is None:
+            slot = self.__allocate(task_id)
+
+        head = (self.head[slot] + 1) % self.window_size
+        base = slot * self.window_size
+        for name in SampleStore.COLUMNS:
+            self.columns[name][base + head] = task_details[name]
+        self.head[slot] = head
+        self.length[slot] = min(self.length[slot] + 1, self.window_size)
+        self.sample_count[slot] = task_details['sample_count']
+        self.avg_cpu_util[slot] = task_details['avg_cpu_util']
+        self.avg_mem_util[slot] = task_details['avg_mem_util']
+        self.last_cycle[slot] = self.cycle + 1
+        if self.tracking:
+            self.dirty.add(task_id)
+            self.evicted.discard(task_id)
+
+    def carry(self, task_id):
+        # Return the last sample of a task whose statistics were not
+        # refreshed this cycle, marked stale, or None when there is no prior
+        # sample to carry forward
+        slot = self.prior(task_id)
+        if slot is None:
+            return None
+        task_details = dict((name, self.last(slot, name))
+                            for name in SampleStore.COLUMNS)
+        task_details['sample_count'] = self.sample_count[slot]
+        task_details['avg_cpu_util'] = self.avg_cpu_util[slot]
+        task_details['avg_mem_util'] = self.avg_mem_util[slot]
+        task_details['stale'] = True
+        return task_details
+
+    def touch(self, task_id):
+        # Keep a task carried forward in this cycle without adding a sample
+        slot = self.slots.get(task_id)
+        if slot is not None:
+            self.last_cycle[slot] = self.cycle + 1
+
+    def commit(self, apps_details):
+        # Store the sample of every task collected in this cycle and evict
+        # tasks that have not been seen for a whole window
+        for app, app_details in apps_details.items():
+            if not app_details:
+                continue
+            for task_id, task_details in app_details['tasks'].items():
+                if task_details and task_details.get('stale'):
+                    self.touch(task_id)
+                elif task_details:
+                    self.append(task_id, task_details)
+
+        self.cycle = self.cycle + 1
+        for slot in self.tasks.keys():
+            if self.cycle - self.last_cycle[slot] >= self.window_size:
+                self.__evict(slot)
+
+    def reset_sample_count(self, task_id):
+        slot = self.slots.get(task_id)
+        if slot is not None:
+            self.sample_count[slot] = 0
+            if self.tracking:
+                self.dirty.add(task_id)
+
+    def restore(self, task_id, window, sample_count, avg_cpu_util,
+                avg_mem_util):
+        # Reload a task saved by an earlier run as if it was sampled in the
+        # last committed cycle. window maps each column to its values,
+        # oldest first
+        slot = self.slots.get(task_id)
+        if slot is None:
+            slot = self.__allocate(task_id)
+        length = min(len(window['timestamp']), self.window_size)
+        base = slot * self.window_size
+        for name in SampleStore.COLUMNS:
+            values = window[name][-length:]
+            for i in range(length):
+                self.columns[name][base + i] = values[i]
+        self.head[slot] = (length - 1) % self.window_size
+        self.length[slot] = length
+        self.sample_count[slot] = sample_count
+        self.avg_cpu_util[slot] = avg_cpu_util
+        self.avg_mem_util[slot] = avg_mem_util
+        self.last_cycle[slot] = self.cycle
+
+    def changes(self):
+        # Return and forget the tasks updated and evicted since the last call,
+        # only recorded once tracking is turned on by a checkpoint
+        dirty, evicted = self.dirty, self.evicted
+        self.dirty = set()
+        self.evicted = set()
+        return dirty, evicted
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __init__(self, window_size, capacity=1024):
+        self.window_size = window_size
+        self.capacity = 0
+        self.cycle = 0
+        self.slots = {}
+        self.tasks = {}
+        self.free_slots = []
+        self.tracking = False
+        self.dirty = set()
+        self.evicted = set()
+        self.columns = dict((name, array('d')) for name in SampleStore.COLUMNS)
+        self.head = array('l')
+        self.length = array('l')
+        self.last_cycle = array('l')
+        self.sample_count = array('l')
+        self.avg_cpu_util = array('d')
+        self.avg_mem_util = array('d')
+        self.__grow(capacity)
@@ -0,0 +1,93 @@
+import time
+import urlparse
+import threading
+
+
+class PollScheduler(object):
+    # Runs poll cycles on a fixed rate clock: every deadline is the previous
+    # deadline plus the period rather than the end of the last cycle plus
+    # the period, so the time cycles take does not add up into drift. A
+    # cycle that overruns skips the ticks it missed instead of running them
+    # back to back.
+    #
+    # The period is hot_interval while any App is close to a threshold and
+    # interval otherwise. Errors and slow responses from Marathon or Mesos
+    # double a backoff factor the period is multiplied by, up to
+    # max_interval, and every healthy cycle halves it again.
+    #
+    # Slow is relative to the usual latency of each endpoint, a moving
+    # average, as listing every App of a large cluster steadily takes longer
+    # than most requests ever do. A request is slow when it takes
+    # latency_factor times the usual and at least latency_budget seconds
+
+    def endpoint(self, client, method, url):
+        path = urlparse.urlparse(url).path
+        if '/v2/apps/' in path:
+            path = path[:path.index('/v2/apps/')] + '/v2/apps/<app>'
+        return client + ' ' + method + ' ' + path
+
+    def observe(self, client, method, url, code, elapsed):
+        # Transport listener for the Marathon and Mesos clients, code is
+        # None when the request failed without a response
+        if client not in ('marathon', 'mesos'):
+            return
+        endpoint = self.endpoint(client, method, url)
+        with self.lock:
+            if code is None or code >= 500:
+                self.errors = self.errors + 1
+                return
+            usual = self.usual.get(endpoint)
+            if usual is not None and elapsed >= self.latency_budget and \
+                    elapsed > usual * self.latency_factor:
+                self.slow = self.slow + 1
+            self.usual[endpoint] = elapsed if usual is None else \
+                usual + (elapsed - usual) * 0.2
+
+    def completed(self, hot=False, error=False, now=None):
+        # Account for a finished cycle and schedule the next one. Return the
+        # new period
+        now = now or time.time()
+        with self.lock:
+            degraded = error or self.errors or self.slow
+            self.errors = 0
+            self.slow = 0
+
+        if degraded:
+            self.backoff = min(self.backoff * 2,
+                               self.max_interval / self.interval)
+        else:
+            self.backoff = max(1.0, self.backoff / 2)
+
+        base = self.hot_interval if hot else self.interval
+        self.period = min(base * self.backoff, self.max_interval)
+
+        self.deadline = self.deadline + self.period
+        if self.deadline <= now:
+            missed = int((now - self.deadline) / self.period) + 1
+            self.skipped = self.skipped + missed
+            self.deadline = self.deadline + missed * self.period
+        return self.period
+
+    def wait(self, now=None):
+        # Sleep until the next deadline, return how late the cycle starts
+        now = now or time.time()
+        if self.deadline > now:
+            time.sleep(self.deadline - now)
+            return 0.0
+        return now - self.deadline
+
+    def __init__(self, interval=5, hot_interval=5, max_interval=60,
+                 latency_budget=2.0, latency_factor=3.0):
+        self.interval = float(interval)
+        self.hot_interval = float(min(hot_interval, interval))
+        self.max_interval = float(max(max_interval, interval))
+        self.latency_budget = latency_budget
+        self.latency_factor = latency_factor
+        self.period = self.interval
+        self.backoff = 1.0
+        self.deadline = time.time()
+        self.skipped = 0
+        self.errors = 0
+        self.slow = 0
+        self.usual = {}
+        self.lock = threading.Lock()
@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import SocketServer
+import BaseHTTPServer
+from multiprocessing import Process
+
+"""
+Local stand-in for a Marathon/Mesos cluster driven by a trace. One HTTP
+server answers the Marathon API, the Mesos master metrics and the statistics
+of every Mesos Agent. Agents are told apart by the loopback address they are
+reached on (127.0.1.1, 127.0.1.2, ...), so the autoscaler talks to them as if
+they were separate hosts.
+"""
+
+
+class Trace(object):
+    # Utilization of every App over time. Each App has a list of
+    # (cpu_util, mem_util) steps that are replayed step seconds apart and
+    # hold on the last step once the trace runs out
+
+    def utilization(self, app, elapsed):
+        steps = self.apps[app]['steps']
+        return steps[min(int(elapsed / self.step), len(steps) - 1)]
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump({'step': self.step, 'apps': self.apps}, f)
+
+    @staticmethod
+    def load(path):
+        with open(path) as f:
+            trace = json.load(f)
+        return Trace(trace['apps'], step=trace.get('step', 5))
+
+    @staticmethod
+    def synthetic(task_count, tasks_per_app=10, hot=0.1, cold=0.1, seed=0):
+        # Hot Apps run above the CPU threshold, cold Apps sit idle and the
+        # rest stay comfortably in between. expected is the action the
+        # autoscaler should take for each App
+        rnd = random.Random(seed)
+        app_count = max(1, task_count // tasks_per_app)
+        apps = {}
+        for i in range(app_count):
+            name = 'app-%05d' % i
+            instances = tasks_per_app
+            if i == app_count - 1:
+                instances = task_count - i * tasks_per_app
+            kind = rnd.random()
+            if kind < hot:
+                steps = [(0.95, 0.40)]
+                expected = 'instances_up'
+            elif kind < hot + cold and instances > 2:
+                steps = [(0.02, 0.05)]
+                expected = 'mem_down'
+            else:
+                steps = [(0.40, 0.40)]
+                expected = None
+            apps[name] = {'instances': instances, 'cpus': 1.0, 'mem': 256,
+                          'steps': steps, 'expected': expected}
+        return Trace(apps)
+
+    def __init__(self, apps, step=5):
+        self.apps = apps
+        self.step = step
+
+
+class FakeCluster(object):
+    def __add_task(self, app):
+        self.task_serial = self.task_serial + 1
+        task_id = '%s.%08d' % (app, self.task_serial)
+        host = self.agents[self.task_serial % len(self.agents)]
+        self.tasks[task_id] = {'app': app, 'host': host, 'cpus_time': 0.0,
+                               'updated': time.time()}
+        self.host_tasks[host].add(task_id)
+        self.apps[app]['tasks'].append(task_id)
+
+    def __scale(self, app, data, deployment_id=None):
+        details = self.apps[app]
+        if 'mem' in data:
+            details['mem'] = data['mem']
+        if 'instances' in data:
+            while len(details['tasks']) < data['instances']:
+                self.__add_task(app)
+            while len(details['tasks']) > data['instances']:
+                task_id = details['tasks'].pop()
+                self.host_tasks[self.tasks.pop(task_id)['host']]\
+                    .discard(task_id)
+            details['instances'] = data['instances']
+
+        if deployment_id is None:
+            self.deployment_serial = self.deployment_serial + 1
+            deployment_id = 'deployment-%d' % self.deployment_serial
+        self.deployments.setdefault(deployment_id, ([], time.time() +
+                                                    self.deploy_delay))[0]\
+            .append(app)
+        self.actions.append({'app': app, 'data': data,
+                             'deploymentId': deployment_id,
+                             'time': time.time()})
+        return deployment_id
+
+    def __app_json(self, app, embed_tasks=True):
+        details = self.apps[app]
+        app_json = {'id': '/' + app, 'instances': details['instances'],
+                    'cpus': details['cpus'], 'mem': details['mem']}
+        if embed_tasks:
+            app_json['tasks'] = [{'id': task_id, 'appId': '/' + app,
+                                  'host': self.tasks[task_id]['host']}
+                                 for task_id in details['tasks']]
+        return app_json
+
+    def __agent_statistics(self, host):
+        now = time.time()
+        elapsed = now - self.started
+        statistics = []
+        for task_id in self.host_tasks.get(host, ()):
+            task = self.tasks[task_id]
+            app = self.apps[task['app']]
+            cpu_util, mem_util = self.trace.utilization(task['app'], elapsed)
+            task['cpus_time'] = task['cpus_time'] + \
+                cpu_util * app['cpus'] * (now - task['updated'])
+            task['updated'] = now
+            mem_limit = app['mem'] * 1024 * 1024
+            statistics.append({
+                'executor_id': task_id,
+                'statistics': {'timestamp': now,
+                               'cpus_system_time_secs': task['cpus_time'] / 2,
+                               'cpus_user_time_secs': task['cpus_time'] / 2,
+                               'cpus_limit': app['cpus'],
+                               'mem_rss_bytes': int(mem_util * mem_limit),
+                               'mem_limit_bytes': mem_limit}})
+        return statistics
+
+    def __agent_used(self, host):
+        used = {'cpus': 0.0, 'mem': 0.0}
+        for task_id in self.host_tasks.get(host, ()):
+            app = self.apps[self.tasks[task_id]['app']]
+            used['cpus'] = used['cpus'] + app['cpus']
+            used['mem'] = used['mem'] + app['mem']
+        return used
+
+    def handle(self, method, path, host, body):
+        # Returns (status, json body) for a request against the cluster
+        endpoint = method + ' ' + path.split('?')[0]
+        if endpoint.startswith('PUT /v2/apps/'):
+            endpoint = 'PUT /v2/apps/<app>'
+        elif endpoint.startswith('GET /v2/apps/'):
+            endpoint = 'GET /v2/apps/<app>'
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            now = time.time()
+            for deployment_id, (apps, done) in self.deployments.items():
+                if done <= now:
+                    del self.deployments[deployment_id]
+
+            if path == '/monitor/statistics.json':
+                return 200, self.__agent_statistics(host)
+            if path == '/api/v1' and method == 'POST':
+                if body.get('type') != 'GET_CONTAINERS':
+                    return 400, {'message': 'Unsupported call'}
+                containers = [{'executor_id': {'value': task['executor_id']},
+                               'container_id': {'value': task['executor_id']},
+                               'resource_statistics': task['statistics']}
+                              for task in self.__agent_statistics(host)]
+                return 200, {'type': 'GET_CONTAINERS',
+                             'get_containers': {'containers': containers}}
+            if path == '/slaves':
+                return 200, {'slaves': [
+                    {'id': 'S%d' % i, 'hostname': agent,
+                     'pid': 'slave(1)@%s:%d' % (agent, self.port),
+                     'active': True,
+                     'resources': {
+                         'cpus': float(self.cpus_total) / len(self.agents),
+                         'mem': float(self.mem_total) / len(self.agents)},
+                     'used_resources': self.__agent_used(agent)}
+                    for i, agent in enumerate(self.agents)]}
+            if path == '/metrics/snapshot':
+                return 200, {'master/cpus_total': self.cpus_total,
+                             'master/cpus_used': sum(
+                                 a['cpus'] * a['instances']
+                                 for a in self.apps.values()),
+                             'master/mem_total': self.mem_total,
+                             'master/mem_used': sum(
+                                 a['mem'] * a['instances']
+                                 for a in self.apps.values())}
+            if path == '/v2/deployments':
+                return 200, [{'id': deployment_id,
+                              'affectedApps': ['/' + app for app in apps]}
+                             for deployment_id, (apps, done)
+                             in self.deployments.items()]
+            if path == '/v2/tasks':
+                return 200, {'tasks': [{'id': task_id,
+                                        'appId': '/' + task['app'],
+                                        'host': task['host']}
+                                       for task_id, task
+                                       in self.tasks.items()]}
+            if path == '/v2/apps' and method == 'PUT':
+                updates = [(update['id'].strip('/'), update)
+                           for update in body]
+                if any(app not in self.apps for app, update in updates):
+                    return 404, {'message': 'App not found'}
+                self.deployment_serial = self.deployment_serial + 1
+                deployment_id = 'deployment-%d' % self.deployment_serial
+                for app, update in updates:
+                    self.__scale(app, dict((key, value)
+                                           for key, value in update.items()
+                                           if key != 'id'), deployment_id)
+                return 200, {'deploymentId': deployment_id,
+                             'version': time.time()}
+            if path.startswith('/v2/apps?') or path == '/v2/apps':
+                return 200, {'apps': [self.__app_json(app, 'embed' in path)
+                                      for app in sorted(self.apps)]}
+            if path.startswith('/v2/apps/'):
+                app = path[len('/v2/apps/'):].strip('/')
+                if app not in self.apps:
+                    return 404, {'message': 'App not found'}
+                if method == 'PUT':
+                    return 200, {'deploymentId': self.__scale(app, body),
+                                 'version': time.time()}
+                return 200, {'app': self.__app_json(app)}
+            if path == '/_sim/stats':
+                return 200, {'requests': self.requests,
+                             'actions': self.actions,
+                             'tasks': len(self.tasks),
+                             'agents': len(self.agents)}
+            return 404, {'message': 'Not found'}
+
+    def serve_forever(self):
+        cluster = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def __respond(self, method):
+                body = None
+                length = int(self.headers.getheader('content-length') or 0)
+                if length:
+                    body = json.loads(self.rfile.read(length))
+                status, response = cluster.handle(
+                    method, self.path, self.connection.getsockname()[0], body)
+                payload = json.dumps(response)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self.__respond('GET')
+
+            def do_PUT(self):
+                self.__respond('PUT')
+
+            def do_POST(self):
+                self.__respond('POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+            request_queue_size = 256
+
+        Server(('0.0.0.0', self.port), Handler).serve_forever()
+
+    def start(self):
+        # Serve from a separate process so the cluster doesn't compete with
+        # the autoscaler for the GIL
+        self.process = Process(target=self.serve_forever)
+        self.process.daemon = True
+        self.process.start()
+        time.sleep(0.5)
+        return self.process
+
+    def stop(self):
+        self.process.terminate()
+
+    def __init__(self, trace, port=18080, agent_count=8, deploy_delay=10,
+                 cpus_total=100000, mem_total=100000000):
+        self.trace = trace
+        self.port = port
+        self.deploy_delay = deploy_delay
+        self.cpus_total = cpus_total
+        self.mem_total = mem_total
+        self.agents = ['127.0.1.%d' % (i + 1) for i in range(agent_count)]
+        self.host_tasks = dict((host, set()) for host in self.agents)
+        self.started = time.time()
+        self.apps = {}
+        self.tasks = {}
+        self.deployments = {}
+        self.actions = []
+        self.requests = {}
+        self.task_serial = 0
+        self.deployment_serial = 0
+        self.lock = threading.Lock()
+        for app, details in sorted(trace.apps.items()):
+            self.apps[app] = {'instances': details['instances'],
+                              'cpus': details['cpus'], 'mem': details['mem'],
+                              'tasks': []}
+            for i in range(details['instances']):
+                self.__add_task(app)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fake Marathon/Mesos cluster')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--tasks', type=int, default=100)
+    parser.add_argument('--agents', type=int, default=8)
+    parser.add_argument('--trace', help='JSON trace to replay')
+    parser.add_argument('--deploy-delay', type=float, default=10)
+    args = parser.parse_args()
+
+    trace = Trace.load(args.trace) if args.trace else \
+        Trace.synthetic(args.tasks)
+    cluster = FakeCluster(trace, port=args.port, agent_count=args.agents,
+                          deploy_delay=args.deploy_delay)
+    print "Serving fake cluster on port %d with agents %s" % (
+        args.port, ', '.join(cluster.agents))
+    sys.stdout.flush()
+    cluster.serve_forever()
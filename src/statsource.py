@@ -0,0 +1,134 @@
+import time
+import json
+import threading
+import traceback
+
+import jsonstream
+
+"""
+Sources of Mesos Agent statistics. Marathon only tells which host a task runs
+on, the agent directory turns that into the base URL the agent is reached at:
+the address and port from the pid the agent registered with the master, or a
+URL through a proxy in front of the agents, e.g. {mesos_url}/slave/{agent_id}
+on clusters where only the master is reachable. Agents the master does not
+know about are reached on the host and the configured agent port.
+
+Every source implements
+
+    fetch(transport, base_url, stream)
+
+returning a dict of executor_id to the STAT_FIELDS of its statistics for one
+agent. The legacy source reads /monitor/statistics.json, the operator source
+asks the v1 operator API for every container of the agent with a single
+GET_CONTAINERS call.
+"""
+
+DEFAULT_AGENT_URL = 'http://{address}'
+
+
+def agent_auth(config):
+    # Agents reached through the master are reached with its credentials
+    if '{mesos_url}' in config.agent_url:
+        return (config.mesos_user, config.mesos_pass)
+    return None
+
+
+class AgentDirectory(object):
+    # Hostname to agent id and address from the master's /slaves, cached for
+    # ttl seconds. A host that is not in the cached list triggers an early
+    # refresh, at most once every min_interval seconds, so new agents are
+    # found quickly without an unknown host querying the master every cycle
+
+    def __refresh(self, now):
+        agents = {}
+        try:
+            for slave in self.mesos.get_slaves():
+                pid = slave.get('pid', '')
+                address = pid.split('@', 1)[1] if '@' in pid else \
+                    '%s:%s' % (slave['hostname'], slave.get('port',
+                                                            self.port))
+                agents[slave['hostname']] = (slave['id'], address)
+        except Exception:
+            traceback.print_exc()
+            agents = None
+        with self.lock:
+            self.attempted = now
+            if agents is not None:
+                self.agents = agents
+                self.refreshed = now
+
+    def __outdated(self, host, now):
+        with self.lock:
+            if now - self.attempted < self.min_interval:
+                return False
+            return now - self.refreshed >= self.ttl or \
+                host not in self.agents
+
+    def lookup(self, host, now=None):
+        # Return (agent id or None, address) of the agent on a host
+        now = now or time.time()
+        if self.mesos and self.__outdated(host, now):
+            # only one of the threads fetching agents refreshes
+            with self.refresh_lock:
+                if self.__outdated(host, now):
+                    self.__refresh(now)
+        with self.lock:
+            return self.agents.get(host,
+                                   (None, '%s:%d' % (host, self.port)))
+
+    def url(self, host, now=None):
+        # Base URL of the agent on a host, without a trailing slash
+        agent_id, address = self.lookup(host, now)
+        if agent_id is None and '{agent_id}' in self.template:
+            # proxied by agent id, which is unknown, try the agent directly
+            return DEFAULT_AGENT_URL.format(address=address)
+        return self.template.format(host=host, port=address.split(':')[-1],
+                                    address=address, agent_id=agent_id,
+                                    mesos_url=self.mesos_url).rstrip('/')
+
+    def __init__(self, mesos=None, port=5051, template=DEFAULT_AGENT_URL,
+                 mesos_url='', ttl=300, min_interval=30):
+        # Without mesos every agent is reached on its host and port
+        self.mesos = mesos
+        self.port = port
+        self.template = template or DEFAULT_AGENT_URL
+        self.mesos_url = mesos_url.rstrip('/')
+        self.ttl = ttl
+        self.min_interval = min(min_interval, ttl)
+        self.agents = {}
+        self.refreshed = 0
+        self.attempted = 0
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+
+
+class LegacyStatisticsSource(object):
+    METHOD = 'GET'
+    PATH = '/monitor/statistics.json'
+
+    def fetch(self, transport, base_url, stream=False):
+        response = transport.get(base_url + self.PATH, stream=stream)
+        response.raise_for_status()
+        return jsonstream.agent_statistics(response, stream)
+
+
+class OperatorStatisticsSource(object):
+    METHOD = 'POST'
+    PATH = '/api/v1'
+    CALL = json.dumps({'type': 'GET_CONTAINERS',
+                       'get_containers': {'show_nested': False,
+                                          'show_standalone': False}})
+    HEADERS = {'Content-Type': 'application/json',
+               'Accept': 'application/json'}
+
+    def fetch(self, transport, base_url, stream=False):
+        # The v1 responses are parsed whole, stream parsing only applies to
+        # the legacy endpoint
+        response = transport.post(base_url + self.PATH, data=self.CALL,
+                                  headers=self.HEADERS)
+        response.raise_for_status()
+        return jsonstream.container_statistics(response)
+
+
+STATISTICS_SOURCES = {'legacy': LegacyStatisticsSource,
+                      'operator': OperatorStatisticsSource}
@@ -0,0 +1,109 @@
+import os
+import json
+import zlib
+import struct
+import threading
+
+"""
+Append-only capture of the raw data seen by each poll cycle: the Marathon App
+details, the agent statistics index, the Mesos master metrics snapshot and,
+with the capacity planner, the free resources of every agent.
+
+The file starts with MAGIC followed by a sequence of frames. Every frame is a
+fixed size header (kind, cycle, timestamp, payload length) followed by a zlib
+compressed JSON payload, so a reader seeks by time from header to header
+without decompressing any payload it skips. A frame cut short by a crash is
+ignored when reading and cut off before the writer appends to the capture
+again. Frames of a kind other than CYCLE are skipped.
+"""
+
+MAGIC = 'ASTL\x01'
+HEADER = struct.Struct('>cIdI')
+CYCLE = 'C'
+
+
+class TelemetryWriter(object):
+    def __write_frame(self, kind, cycle, timestamp, payload):
+        data = zlib.compress(json.dumps(payload, separators=(',', ':')))
+        offset = self.file.tell()
+        self.file.write(HEADER.pack(kind, cycle, timestamp, len(data)))
+        self.file.write(data)
+        self.file.flush()
+        return offset
+
+    def write_cycle(self, timestamp, apps_details, task_stats_index,
+                    master_metrics, stale_hosts=None, agents=None):
+        with self.lock:
+            self.cycle = self.cycle + 1
+            self.__write_frame(CYCLE, self.cycle, timestamp,
+                               {'apps': apps_details,
+                                'stats': task_stats_index,
+                                'master': master_metrics,
+                                'stale': stale_hosts or {},
+                                'agents': agents})
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+    def __init__(self, path):
+        self.path = path
+        self.cycle = 0
+        self.lock = threading.Lock()
+
+        # Keep numbering from where an existing capture left off, after the
+        # last complete frame so a frame cut short by a crash doesn't swallow
+        # the frames appended after it
+        if os.path.exists(path) and os.path.getsize(path) > len(MAGIC):
+            end = len(MAGIC)
+            for kind, cycle, timestamp, offset, length in \
+                    TelemetryReader(path).headers():
+                self.cycle = max(self.cycle, cycle)
+                end = offset + HEADER.size + length
+            self.file = open(path, 'r+b')
+            self.file.truncate(end)
+            self.file.seek(end)
+        else:
+            self.file = open(path, 'wb')
+            self.file.write(MAGIC)
+
+
+class TelemetryReader(object):
+    def headers(self):
+        # Yield (kind, cycle, timestamp, offset, length) of every complete
+        # frame without decompressing any payload
+        with open(self.path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(self.path + " is not a telemetry capture")
+            size = os.fstat(f.fileno()).st_size
+            while True:
+                offset = f.tell()
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    return
+                kind, cycle, timestamp, length = HEADER.unpack(header)
+                if offset + HEADER.size + length > size:
+                    return
+                yield kind, cycle, timestamp, offset, length
+                f.seek(length, os.SEEK_CUR)
+
+    def __read_payload(self, f, offset):
+        f.seek(offset)
+        kind, cycle, timestamp, length = HEADER.unpack(f.read(HEADER.size))
+        return cycle, timestamp, json.loads(zlib.decompress(f.read(length)))
+
+    def cycles(self, start=None, end=None):
+        # Yield (cycle, timestamp, payload) of every cycle captured between
+        # the start and end timestamps
+        with open(self.path, 'rb') as f:
+            for kind, cycle, timestamp, offset, length in self.headers():
+                if kind != CYCLE:
+                    continue
+                if start is not None and timestamp < start:
+                    continue
+                if end is not None and timestamp > end:
+                    return
+                yield self.__read_payload(f, offset)
+
+    def __init__(self, path):
+        self.path = path
@@ -0,0 +1,61 @@
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+
+class Transport(object):
+    def __request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        kwargs.setdefault('verify', self.verify)
+        response = None
+        start = time.time()
+        try:
+            response = self.session.request(method, url, **kwargs)
+            return response
+        finally:
+            elapsed = time.time() - start
+            for listener in self.listeners:
+                listener(self.name, method, url, response, elapsed)
+
+    def add_listener(self, listener):
+        # listener(name, method, url, response, elapsed) is called after every
+        # request, response is None when the request failed
+        self.listeners.append(listener)
+
+    def get(self, url, **kwargs):
+        return self.__request('GET', url, **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self.__request('PUT', url, data=data, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.__request('POST', url, data=data, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+    def __init__(self, auth=None, connect_timeout=3.05, read_timeout=10,
+                 retries=2, backoff=0.3, pool_connections=16, pool_maxsize=4,
+                 verify=False, name='http'):
+        # A pooled, keep-alive session. pool_connections is the number of
+        # hosts to keep pools for and pool_maxsize the number of connections
+        # kept open to each one of them
+        self.name = name
+        self.listeners = []
+        self.timeout = (connect_timeout, read_timeout)
+        self.verify = verify
+
+        retry = Retry(total=retries, connect=retries, read=retries,
+                      status=retries, backoff_factor=backoff,
+                      status_forcelist=(502, 503, 504),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize,
+                              max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if auth and auth[0]:
+            self.session.auth = auth
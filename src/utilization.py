@@ -0,0 +1,148 @@
+import time
+
+numpy = None
+numpy_imported = False
+
+
+def available():
+    # numpy takes a while to import, so it is only imported the first time
+    # the poll loop asks for it rather than at startup
+    global numpy, numpy_imported
+    if not numpy_imported:
+        numpy_imported = True
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+    return numpy is not None
+
+
+def compute_utilization(apps_details, task_stats_index, samples, sample_size):
+    # Batched equivalent of sample_app_tasks followed by compute_app_averages.
+    # Every task's current statistics and prior sample are gathered into
+    # arrays once, utilization and running averages are computed for all
+    # tasks at once and the per App figures are reduced with bincount
+
+    apps = []
+    tasks = []
+    app_index = []
+    slots = []
+    sample_sizes = []
+    timestamps = []
+    cpus_times = []
+    mem_rss = []
+    mem_limit = []
+
+    for app, app_details in apps_details.items():
+        if not app_details:
+            continue
+        for task_id, task_details in app_details['tasks'].items():
+            task_stats = task_stats_index.get(task_id)
+            if not task_stats:
+                app_details['tasks'][task_id] = None
+                continue
+
+            slot = samples.prior(task_id)
+            tasks.append(task_details)
+            app_index.append(len(apps))
+            slots.append(-1 if slot is None else slot)
+            sample_sizes.append(app_details.get('sample_size', sample_size))
+            timestamps.append(task_stats['timestamp']
+                              if 'timestamp' in task_stats else time.time())
+            cpus_times.append(task_stats['cpus_system_time_secs'] +
+                              task_stats['cpus_user_time_secs'])
+            mem_rss.append(int(task_stats['mem_rss_bytes']))
+            mem_limit.append(int(task_stats['mem_limit_bytes']))
+        apps.append(app_details)
+
+    app_index = numpy.array(app_index, dtype=numpy.int_)
+    slots = numpy.array(slots, dtype=numpy.int_)
+    timestamp = numpy.array(timestamps, dtype=numpy.float64)
+    cpus_time = numpy.array(cpus_times, dtype=numpy.float64)
+    mem_util = numpy.array(mem_rss, dtype=numpy.float64) /\
+        numpy.array(mem_limit, dtype=numpy.float64)
+
+    # Read the prior sample of every task straight out of the store's arrays
+    has_prior = slots >= 0
+    prior_slots = numpy.where(has_prior, slots, 0)
+    head = numpy.frombuffer(samples.head, dtype=numpy.int_)
+    latest = prior_slots * samples.window_size + head[prior_slots]
+    prior_timestamp = numpy.frombuffer(samples.columns['timestamp'],
+                                       dtype=numpy.float64)[latest]
+    prior_cpus_time = numpy.frombuffer(samples.columns['cpus_time'],
+                                       dtype=numpy.float64)[latest]
+    prior_count = numpy.frombuffer(samples.sample_count,
+                                   dtype=numpy.int_)[prior_slots]
+    prior_avg_cpu = numpy.frombuffer(samples.avg_cpu_util,
+                                     dtype=numpy.float64)[prior_slots]
+    prior_avg_mem = numpy.frombuffer(samples.avg_mem_util,
+                                     dtype=numpy.float64)[prior_slots]
+
+    elapsed = timestamp - prior_timestamp
+    measured = has_prior & (elapsed > 0)
+    cpu_util = numpy.where(measured,
+                           (cpus_time - prior_cpus_time) /
+                           numpy.where(measured, elapsed, 1.0), 0.0)
+
+    sample_count = numpy.where(has_prior,
+                               numpy.minimum(prior_count,
+                                             numpy.array(sample_sizes)),
+                               0) + 1
+    weight = sample_count.astype(numpy.float64)
+    avg_cpu_util = numpy.where(has_prior,
+                               ((1 / weight) * cpu_util) +
+                               (((weight - 1) / weight) * prior_avg_cpu),
+                               cpu_util)
+    avg_mem_util = numpy.where(has_prior,
+                               ((1 / weight) * mem_util) +
+                               (((weight - 1) / weight) * prior_avg_mem),
+                               mem_util)
+
+    # Per App sums, sample weighted averages and largest sample count
+    app_count = len(apps)
+    app_cpu_util = numpy.bincount(app_index, weights=cpu_util,
+                                  minlength=app_count)
+    app_mem_util = numpy.bincount(app_index, weights=mem_util,
+                                  minlength=app_count)
+    app_samples = numpy.bincount(app_index, weights=weight,
+                                 minlength=app_count)
+    app_sum_cpu_util = numpy.bincount(app_index,
+                                      weights=weight * avg_cpu_util,
+                                      minlength=app_count)
+    app_sum_mem_util = numpy.bincount(app_index,
+                                      weights=weight * avg_mem_util,
+                                      minlength=app_count)
+    has_samples = app_samples > 0
+    divisor = numpy.where(has_samples, app_samples, 1.0)
+    app_avg_cpu_util = numpy.where(has_samples, app_sum_cpu_util / divisor,
+                                   0.0)
+    app_avg_mem_util = numpy.where(has_samples, app_sum_mem_util / divisor,
+                                   0.0)
+    max_samples_in_app = numpy.zeros(app_count, dtype=numpy.int_)
+    numpy.maximum.at(max_samples_in_app, app_index, sample_count)
+
+    columns = zip(tasks, timestamp.tolist(), cpus_time.tolist(),
+                  cpu_util.tolist(), mem_rss, mem_limit, mem_util.tolist(),
+                  sample_count.tolist(), avg_cpu_util.tolist(),
+                  avg_mem_util.tolist())
+    for task_details, task_timestamp, task_cpus_time, task_cpu_util, \
+            task_mem_rss, task_mem_limit, task_mem_util, task_sample_count, \
+            task_avg_cpu_util, task_avg_mem_util in columns:
+        task_details['timestamp'] = task_timestamp
+        task_details['cpus_time'] = task_cpus_time
+        task_details['cpu_util'] = task_cpu_util
+        task_details['mem_rss_bytes'] = task_mem_rss
+        task_details['mem_limit_bytes'] = task_mem_limit
+        task_details['mem_util'] = task_mem_util
+        task_details['sample_count'] = task_sample_count
+        task_details['avg_cpu_util'] = task_avg_cpu_util
+        task_details['avg_mem_util'] = task_avg_mem_util
+
+    for i, app_details in enumerate(apps):
+        task_count = len(app_details['tasks'])
+        app_details['cpu_util'] = float(app_cpu_util[i]) / task_count
+        app_details['mem_util'] = float(app_mem_util[i]) / task_count
+        app_details['max_samples_in_app'] = int(max_samples_in_app[i])
+        app_details['task_count'] = task_count
+        app_details['app_avg_cpu_util'] = float(app_avg_cpu_util[i])
+        app_details['app_avg_mem_util'] = float(app_avg_mem_util[i])